@@ -70,6 +70,8 @@ class MainApplication(tk.Tk):
             self.board_view = TicTacToeBoardView(self, controller, (75, 75))
         else:
             raise ValueError("Unknown variant " + variant)
+        # Precompute the positions after each move while the side to move thinks
+        controller.start_speculation()
         if time is not None:
             controller.set_tc(TimeControl(time, inc))
             controller.tc.set_clocks((self.board_view.white_timer, self.board_view.black_timer))
@@ -89,6 +91,7 @@ class MainApplication(tk.Tk):
 
     def end_game(self) -> None:
         assert self.board_view is not None
+        self.board_view.controller.stop_speculation()
         self.board_view.destroy()
         self.board_view = None
         self.start_menu = StartMenu(master=self)
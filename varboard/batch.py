@@ -0,0 +1,172 @@
+"""
+Attack maps and pseudo-legal move counts for many 8x8 positions at once, for dataset generation.
+Positions are encoded as uint64 occupancy arrays, one per piece kind, and all positions are processed together with
+NumPy shift-and-mask operations: leapers shift their whole mask by each step, sliders use Kogge-Stone occluded fills.
+Piece movement is taken from Chess.movement, so variants of the Chess family with other piece types work as well.
+"""
+from __future__ import annotations
+
+from typing import Iterable
+
+import numpy as np
+import numpy.typing as npt
+
+from .geometry import KNIGHT_STEPS, KING_STEPS, Direction
+from .state import Position, BitboardPosition, Color
+from .variant import Chess
+
+U64 = np.uint64
+RANK_1 = U64(0x00000000000000FF)
+RANK_8 = U64(0xFF00000000000000)
+
+# Masks dropping the files a shift by x files wrapped into, indexed by x
+FILE_MASKS: dict[int, np.uint64] = {}
+for _x in range(-7, 8):
+    _files = 0
+    for _file in range(8):
+        if 0 <= _file - _x < 8:
+            _files |= 1 << _file
+    FILE_MASKS[_x] = U64(_files * 0x0101010101010101)
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(masks: np.ndarray) -> npt.NDArray[np.int64]:
+    """
+    Number of set bits of every uint64 in an array.
+    """
+    masks = np.ascontiguousarray(masks, dtype=np.uint64)
+    return np.asarray(_POPCOUNT8[masks.view(np.uint8)].reshape(masks.shape + (8,)).sum(axis=-1, dtype=np.int64), dtype=np.int64)
+
+
+def _shift(masks: np.ndarray, bits: int) -> np.ndarray:
+    return masks << U64(bits) if bits >= 0 else masks >> U64(-bits)
+
+
+def step(masks: np.ndarray, d: Direction) -> np.ndarray:
+    """
+    Moves every square of the masks by a (file, rank) step, dropping squares that leave the board.
+    """
+    x, y = d
+    return _shift(masks, 8 * y + x) & FILE_MASKS[x]
+
+
+def slide(masks: np.ndarray, empty: np.ndarray, d: Direction) -> np.ndarray:
+    """
+    Squares attacked by sliders on the masks along one direction, up to and including the first occupied square.
+    Kogge-Stone occluded fill: the sliders are propagated through empty squares in 1, 2 and 4 step jumps.
+    """
+    x, y = d
+    bits = 8 * y + x
+    gen = masks
+    pro = empty & FILE_MASKS[x]
+    gen = gen | pro & _shift(gen, bits)
+    pro = pro & _shift(pro, bits)
+    gen = gen | pro & _shift(gen, 2 * bits)
+    pro = pro & _shift(pro, 2 * bits)
+    gen = gen | pro & _shift(gen, 4 * bits)
+    return step(gen, d)
+
+
+class PositionBatch:
+    """
+    Positions encoded as arrays: a uint64 occupancy mask per piece kind (keyed by FEN letter), whose turn it is,
+    and the en passant target square as a mask (zero if there is none).
+    Square (rank, file) is bit rank * 8 + file, like in varboard.bitboard.
+    """
+
+    def __init__(self, positions: Iterable[Position]):
+        positions = list(positions)
+        masks: dict[str, list[int]] = {}
+        for i, pos in enumerate(positions):
+            items: Iterable[tuple[str, int]]
+            if isinstance(pos, BitboardPosition):
+                items = pos.bitboards.items()
+            else:
+                assert pos.bounds() == (8, 8), "Batches require 8x8 boards"
+                items = ((str(p), 1 << (sq.rank * 8 + sq.file)) for sq, p in pos.piece_list())
+            for key, mask in items:
+                if key not in masks:
+                    masks[key] = [0] * len(positions)
+                masks[key][i] |= mask
+        self.size = len(positions)
+        self.pieces: dict[str, np.ndarray] = {key: np.array(m, dtype=np.uint64) for key, m in masks.items()}
+        self.white_to_move = np.array([Color.from_ply(pos.ply) == Color.WHITE for pos in positions], dtype=bool)
+        eps = [pos.get_extra("ep") for pos in positions]
+        self.ep = np.array([1 << (ep.rank * 8 + ep.file) if ep is not None else 0 for ep in eps], dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def color_masks(self, color: Color) -> dict[str, np.ndarray]:
+        """
+        The piece masks of one color, keyed by piece type.
+        """
+        white = color == Color.WHITE
+        return {key.upper(): m for key, m in self.pieces.items() if key.isupper() == white}
+
+    def occupancy(self, color: Color) -> np.ndarray:
+        occ = np.zeros(self.size, dtype=np.uint64)
+        for m in self.color_masks(color).values():
+            occ |= m
+        return occ
+
+
+def _piece_targets(variant: Chess, ty: str, masks: np.ndarray, empty: np.ndarray) -> list[np.ndarray]:
+    """
+    Attacks of the non-pawn pieces on the masks, one array per step or direction.
+    Pieces reach disjoint squares along any single step or direction, so the arrays' popcounts add up to the move count.
+    """
+    knight, king, rays = variant.movement(ty)
+    out = []
+    if knight:
+        out += [step(masks, d) for d in KNIGHT_STEPS]
+    if king:
+        out += [step(masks, d) for d in KING_STEPS]
+    out += [slide(masks, empty, d) for d in rays]
+    return out
+
+
+def attack_maps(variant: Chess, batch: PositionBatch) -> np.ndarray:
+    """
+    Returns an (N, 2) uint64 array, the squares attacked by white and by black in every position.
+    Squares occupied by the attacker's own pieces count as attacked (defended).
+    """
+    empty = ~(batch.occupancy(Color.WHITE) | batch.occupancy(Color.BLACK))
+    out = np.zeros((batch.size, 2), dtype=np.uint64)
+    for i, color in enumerate((Color.WHITE, Color.BLACK)):
+        forward = 1 if color == Color.WHITE else -1
+        for ty, masks in batch.color_masks(color).items():
+            if ty == "P":
+                out[:, i] |= step(masks, (-1, forward)) | step(masks, (1, forward))
+                continue
+            for targets in _piece_targets(variant, ty, masks, empty):
+                out[:, i] |= targets
+    return out
+
+
+def pseudo_legal_counts(variant: Chess, batch: PositionBatch) -> npt.NDArray[np.int64]:
+    """
+    Returns the number of pseudo-legal moves of the side to move in every position, as an int64 array.
+    These are the moves Chess.target_squares generates, whether or not they leave the king in check, promotions
+    count once per promotion piece. Castling is not included.
+    """
+    counts = np.zeros((2, batch.size), dtype=np.int64)
+    white, black = batch.occupancy(Color.WHITE), batch.occupancy(Color.BLACK)
+    empty = ~(white | black)
+    for i, color in enumerate((Color.WHITE, Color.BLACK)):
+        own, opp = (white, black) if color == Color.WHITE else (black, white)
+        forward = 1 if color == Color.WHITE else -1
+        last = RANK_8 if color == Color.WHITE else RANK_1
+        for ty, masks in batch.color_masks(color).items():
+            if ty == "P":
+                single = step(masks, (0, forward)) & empty
+                double = step(single & (U64(0xFF) << U64(16 if color == Color.WHITE else 40)), (0, forward)) & empty
+                pawn_targets = [single, double]
+                pawn_targets += [step(masks, (x, forward)) & (opp | batch.ep) for x in (-1, 1)]
+                for t in pawn_targets:
+                    counts[i] += popcount(t & ~last) + 4 * popcount(t & last)
+                continue
+            for targets in _piece_targets(variant, ty, masks, empty):
+                counts[i] += popcount(targets & ~own)
+    return np.asarray(np.where(batch.white_to_move, counts[0], counts[1]), dtype=np.int64)
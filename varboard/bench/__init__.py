@@ -0,0 +1,169 @@
+"""
+Micro-benchmarks of the hot paths, run on the fixed corpora of varboard.bench.corpus.
+Results are ops/sec and the peak memory allocated during a pass over the corpus, they can be saved as a JSON baseline and compared against one later.
+Run `python -m varboard.bench --help` for the command line interface.
+"""
+from __future__ import annotations
+
+import json
+import platform
+import queue
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+from . import corpus
+from ..state import Move
+from ..uci import UCIEngine
+from ..variant import fen_board
+
+# A benchmark's setup builds its inputs, and returns the number of ops in one pass and the function running a pass
+Setup = Callable[[list[corpus.Entry]], tuple[int, Callable[[], Any]]]
+
+BENCHMARKS: dict[str, Setup] = {}
+
+
+def benchmark(name: str) -> Callable[[Setup], Setup]:
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@benchmark("execute_move")
+def bench_execute_move(entries: list[corpus.Entry]) -> tuple[int, Callable[[], Any]]:
+    work = [(variant, pos, m) for variant, pos, _, _ in entries for m in variant.legal_moves(pos)]
+
+    def run() -> None:
+        for variant, pos, m in work:
+            variant.execute_move(pos, m)
+    return len(work), run
+
+
+@benchmark("legal_moves")
+def bench_legal_moves(entries: list[corpus.Entry]) -> tuple[int, Callable[[], Any]]:
+    def run() -> None:
+        for variant, pos, _, _ in entries:
+            list(variant.legal_moves(pos))
+    return len(entries), run
+
+
+@benchmark("game_value")
+def bench_game_value(entries: list[corpus.Entry]) -> tuple[int, Callable[[], Any]]:
+    # Every tenth position, game_value replays the whole game
+    work = [(variant, start, moves) for variant, _, start, moves in entries[::10]]
+
+    def run() -> None:
+        for variant, start, moves in work:
+            variant.game_value(start, moves)
+    return len(work), run
+
+
+@benchmark("fen_board")
+def bench_fen_board(entries: list[corpus.Entry]) -> tuple[int, Callable[[], Any]]:
+    def run() -> None:
+        for _, pos, _, _ in entries:
+            fen_board(pos)
+    return len(entries), run
+
+
+@benchmark("Move.from_uci")
+def bench_move_from_uci(entries: list[corpus.Entry]) -> tuple[int, Callable[[], Any]]:
+    work = [(m.to_uci(), pos.ply) for variant, pos, _, _ in entries for m in variant.legal_moves(pos)]
+
+    def run() -> None:
+        for uci, ply in work:
+            Move.from_uci(uci, ply)
+    return len(work), run
+
+
+@benchmark("UCIEngine.process_line")
+def bench_process_line(entries: list[corpus.Entry]) -> tuple[int, Callable[[], Any]]:
+    engine = UCIEngine("", probe=False)
+    lines = corpus.UCI_LINES * 20
+
+    def run() -> None:
+        for line in lines:
+            engine.process_line(line)
+        # Nobody consumes the engine's output here, do not let it pile up
+        engine.uci_info_queue = queue.SimpleQueue()
+        engine.uci_ready_queue = queue.SimpleQueue()
+        engine.uci_move_queue = queue.SimpleQueue()
+    return len(lines), run
+
+
+def measure(ops: int, run: Callable[[], Any], min_time: float = 0.2, repeat: int = 3) -> dict[str, float]:
+    """
+    Times a benchmark pass, returns the best ops/sec over the repeats and the peak bytes allocated during a pass, as traced by tracemalloc.
+    As results are discarded, the peak is the largest working set of a single op plus anything the pass keeps alive.
+    """
+    best = 0.0
+    for _ in range(repeat):
+        passes = 0
+        start = time.perf_counter()
+        while True:
+            run()
+            passes += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, ops * passes / elapsed)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        run()
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_sec": best, "peak_bytes": peak}
+
+
+def run_benchmarks(names: Optional[list[str]] = None, min_time: float = 0.2, repeat: int = 3,
+                   out: Callable[[str], None] = print) -> dict[str, Any]:
+    """
+    Runs the given benchmarks, all of them by default, and returns the results in the baseline format.
+    """
+    entries = corpus.positions()
+    results: dict[str, dict[str, float]] = {}
+    for name in names or list(BENCHMARKS):
+        ops, run = BENCHMARKS[name](entries)
+        results[name] = measure(ops, run, min_time, repeat)
+        out(f"{name:24} {results[name]['ops_per_sec']:12.0f} ops/s {results[name]['peak_bytes']:10.0f} B peak")
+    return {"python": platform.python_version(), "machine": platform.platform(), "corpus": len(entries), "benchmarks": results}
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], threshold: float = 0.1,
+            out: Callable[[str], None] = print) -> list[str]:
+    """
+    Compares results against a baseline, returns the benchmarks that got slower by more than the threshold (a fraction).
+    """
+    regressions = []
+    for key in ("python", "machine", "corpus"):
+        if results.get(key) != baseline.get(key):
+            out(f"warning: baseline {key} is {baseline.get(key)!r}, not {results.get(key)!r}, the numbers are not comparable")
+    for name, res in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            out(f"{name:24} no baseline")
+            continue
+        change = res["ops_per_sec"] / base["ops_per_sec"] - 1
+        regressed = change < -threshold
+        out(f"{name:24} {change:+7.1%} ops/s, {res['peak_bytes'] - base['peak_bytes']:+8.0f} B peak"
+            + (" REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def load(path: str) -> dict[str, Any]:
+    with open(path) as f:
+        data: dict[str, Any] = json.load(f)
+    return data
+
+
+def save(path: str, results: dict[str, Any]) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
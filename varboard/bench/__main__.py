@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import Optional
+
+from . import BENCHMARKS, run_benchmarks, compare, load, save
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m varboard.bench", description="Benchmark the hot paths of varboard.")
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark", help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH",
+                        help="compare the results against a JSON baseline, recorded with --save on the same machine")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression, as a fraction")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds to run each benchmark for, per repeat")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+
+    results = run_benchmarks(args.benchmarks, args.min_time, args.repeat)
+    if args.save:
+        save(args.save, results)
+    if args.compare:
+        print()
+        if compare(results, load(args.compare), args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Fixed position corpora for the benchmarks. Games are played from a seeded generator, choosing among the legal moves
+sorted by their code, so the corpus does not depend on the order moves are generated in.
+"""
+from __future__ import annotations
+
+import random
+
+from ..perft import VARIANTS, KNOWN
+from ..state import Position, Move
+from ..variant import Variant
+
+# (variant, position, the game leading to it: start position and moves)
+Entry = tuple[Variant, Position, Position, tuple[Move, ...]]
+
+
+def random_games(variant: Variant, games: int, plies: int, seed: int) -> list[Entry]:
+    rng = random.Random(seed)
+    out: list[Entry] = []
+    for _ in range(games):
+        start = pos = variant.startpos()
+        moves: list[Move] = []
+        for _ in range(plies):
+            out.append((variant, pos, start, tuple(moves)))
+            legal = sorted(variant.legal_moves(pos), key=lambda m: m.code)
+            if not legal:
+                break
+            m = rng.choice(legal)
+            moves.append(m)
+            pos, _ = variant.execute_move(pos, m)
+    return out
+
+
+def positions(games: int = 4, plies: int = 60, seed: int = 0) -> list[Entry]:
+    """
+    Returns the corpus: positions from random games in every variant, and the perft test positions.
+    """
+    out: list[Entry] = []
+    for name, make in sorted(VARIANTS.items()):
+        variant = make()
+        out += random_games(variant, games, plies, seed)
+        for fen, _ in KNOWN.get(name, []):
+            if fen is not None:
+                pos = variant.pos_from_fen(fen)
+                out.append((variant, pos, pos, ()))
+    return out
+
+
+# Typical engine output, including lines the parser has to skip
+UCI_LINES: list[bytes] = [
+    b"id name Fairy-Stockfish 14.0.1 LB\n",
+    b"option name Hash type spin default 16 min 1 max 33554432\n",
+    b"option name UCI_Variant type combo default chess var chess var racingkings var tictactoe\n",
+    b"option name Ponder type check default false\n",
+    b"uciok\n",
+    b"readyok\n",
+    b"info string variant chess files 8 ranks 8 pocket 0 template fairy startpos rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1\n",
+    b"info depth 1 seldepth 1 multipv 1 score cp 35 nodes 20 nps 20000 tbhits 0 time 1 pv e2e4\n",
+    b"info depth 18 seldepth 24 multipv 1 score cp 27 wdl 78 872 50 nodes 1843302 nps 1203459 hashfull 612 tbhits 0 time 1532 pv e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7\n",
+    b"info depth 18 seldepth 22 multipv 2 score cp 19 lowerbound nodes 1843302 nps 1203459 hashfull 612 tbhits 0 time 1532 pv d2d4 d7d5 c2c4\n",
+    b"info depth 30 seldepth 12 multipv 1 score mate 5 nodes 42 nps 42000 time 1 pv h5f7 e8e7 f7e6\n",
+    b"info currmove e2e4 currmovenumber 1\n",
+    b"bestmove e2e4 ponder e7e5\n",
+]
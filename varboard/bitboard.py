@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+from typing import Iterator, Sequence
+
+from .geometry import Direction, KNIGHT_STEPS, KING_STEPS, PAWN_CAPTURE_STEPS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS
+from .state import BitboardPosition, Square, Color, square_grid
+
+# Square (rank, file) is bit rank * 8 + file, so a1 is bit 0 and h8 is bit 63.
+ALL = (1 << 64) - 1
+
+
+def square_index(sq: Square) -> int:
+    return sq.rank * 8 + sq.file
+
+
+SQUARES = [sq for row in square_grid(8, 8) for sq in row]
+
+
+def index_square(idx: int) -> Square:
+    return SQUARES[idx]
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """
+    Yields the indices of set bits, lowest first.
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _leaper_table(steps: Sequence[Direction]) -> list[int]:
+    table = []
+    for idx in range(64):
+        rank, file = idx >> 3, idx & 7
+        mask = 0
+        for x, y in steps:
+            if 0 <= file + x < 8 and 0 <= rank + y < 8:
+                mask |= 1 << ((rank + y) * 8 + file + x)
+        table.append(mask)
+    return table
+
+
+def _ray_table(x: int, y: int) -> list[int]:
+    table = []
+    for idx in range(64):
+        rank, file = idx >> 3, idx & 7
+        mask = 0
+        while 0 <= file + x < 8 and 0 <= rank + y < 8:
+            file += x
+            rank += y
+            mask |= 1 << (rank * 8 + file)
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_table(KNIGHT_STEPS)
+KING_ATTACKS = _leaper_table(KING_STEPS)
+# Squares attacked by a pawn of the given color standing on a square, indexed [color_index][square]
+PAWN_ATTACKS = (_leaper_table(PAWN_CAPTURE_STEPS[Color.WHITE]), _leaper_table(PAWN_CAPTURE_STEPS[Color.BLACK]))
+RAYS = {d: _ray_table(*d) for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+# Whether a direction increases the bit index, so the nearest square along it is the lowest set bit
+ASCENDING = {d: d[1] > 0 or (d[1] == 0 and d[0] > 0) for d in RAYS}
+
+
+def _between_table() -> list[list[int]]:
+    table = [[0] * 64 for _ in range(64)]
+    for rays in RAYS.values():
+        for idx in range(64):
+            for target in iter_bits(rays[idx]):
+                table[idx][target] = rays[idx] & ~rays[target] & ~(1 << target)
+    return table
+
+
+# Squares strictly between two squares on a common line, zero for unaligned pairs, indexed [square][square]
+BETWEEN = _between_table()
+
+
+def color_index(color: Color) -> int:
+    return 0 if color == Color.WHITE else 1
+
+
+def nearest(d: tuple[int, int], mask: int) -> int:
+    """
+    Index of the set bit of a nonzero mask of squares on one ray that is nearest to the ray's origin.
+    """
+    if ASCENDING[d]:
+        return (mask & -mask).bit_length() - 1
+    return mask.bit_length() - 1
+
+
+def slider_attacks(idx: int, occ: int, directions: tuple[tuple[int, int], ...]) -> int:
+    """
+    Squares reached from idx along the given directions, up to and including the first occupied square.
+    """
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][idx]
+        blockers = ray & occ
+        if blockers:
+            ray ^= RAYS[d][nearest(d, blockers)]
+        attacks |= ray
+    return attacks
+
+
+def bishop_attacks(idx: int, occ: int) -> int:
+    return slider_attacks(idx, occ, BISHOP_DIRECTIONS)
+
+
+def rook_attacks(idx: int, occ: int) -> int:
+    return slider_attacks(idx, occ, ROOK_DIRECTIONS)
+
+
+def attacked(idx: int, occ: int, pawns: int, knights: int, diagonal: int, orthogonal: int, kings: int, by: int) -> bool:
+    """
+    Whether the square idx is attacked, given the attacking side's masks and total occupancy.
+    `diagonal` are the attacker's bishops and queens, `orthogonal` their rooks and queens, `by` the attacker's color index.
+    """
+    if KNIGHT_ATTACKS[idx] & knights or KING_ATTACKS[idx] & kings or PAWN_ATTACKS[1 - by][idx] & pawns:
+        return True
+    if diagonal and bishop_attacks(idx, occ) & diagonal:
+        return True
+    if orthogonal and rook_attacks(idx, occ) & orthogonal:
+        return True
+    return False
+
+
+def checkers_and_pins(kidx: int, occ: int, own: int, pawns: int, knights: int, diagonal: int, orthogonal: int,
+                      kings: int, us: int) -> tuple[int, dict[int, int]]:
+    """
+    For the king on kidx, returns the mask of pieces giving check and, for each absolutely pinned piece of its side,
+    the mask of squares it can still move to: the line between the king and the pinner, including the pinner.
+    The piece masks are the opponent's, `own` is the occupancy of the king's side, `us` its color index.
+    """
+    checkers = KNIGHT_ATTACKS[kidx] & knights | PAWN_ATTACKS[us][kidx] & pawns | KING_ATTACKS[kidx] & kings
+    pins: dict[int, int] = {}
+    for directions, sliders in ((BISHOP_DIRECTIONS, diagonal), (ROOK_DIRECTIONS, orthogonal)):
+        if not sliders:
+            continue
+        for d in directions:
+            ray = RAYS[d][kidx]
+            blockers = ray & occ
+            if not blockers:
+                continue
+            first = nearest(d, blockers)
+            if sliders >> first & 1:
+                checkers |= 1 << first
+                continue
+            if not own >> first & 1:
+                continue
+            beyond = RAYS[d][first] & occ
+            if not beyond:
+                continue
+            second = nearest(d, beyond)
+            if sliders >> second & 1:
+                pins[first] = ray & ~RAYS[d][second]
+    return checkers, pins
+
+
+def side_masks(pos: BitboardPosition, color: Color) -> tuple[int, int, int, int, int]:
+    """
+    Returns (pawns, knights, bishops and queens, rooks and queens, kings) of the given color.
+    """
+    bbs = pos.bitboards
+    if color == Color.WHITE:
+        q = bbs.get("Q", 0)
+        return bbs.get("P", 0), bbs.get("N", 0), bbs.get("B", 0) | q, bbs.get("R", 0) | q, bbs.get("K", 0)
+    q = bbs.get("q", 0)
+    return bbs.get("p", 0), bbs.get("n", 0), bbs.get("b", 0) | q, bbs.get("r", 0) | q, bbs.get("k", 0)
+
+
+def is_attacked(pos: BitboardPosition, idx: int, by: Color) -> bool:
+    white, black = pos.occupancy
+    return attacked(idx, white | black, *side_masks(pos, by), color_index(by))
+
+
+def in_check(pos: BitboardPosition, color: Color) -> bool:
+    """
+    Whether any king of the given color is attacked.
+    """
+    kings = pos.bitboards.get("K" if color == Color.WHITE else "k", 0)
+    white, black = pos.occupancy
+    occ = white | black
+    masks = side_masks(pos, ~color)
+    by = color_index(~color)
+    for idx in iter_bits(kings):
+        if attacked(idx, occ, *masks, by):
+            return True
+    return False
+
+
+def in_check_after(pos: BitboardPosition, fromidx: int, toidx: int, color: Color) -> bool:
+    """
+    Whether a king of the given color would be attacked after the piece on fromidx moves to toidx, capturing whatever stands there.
+    Only handles plain moves, special moves (promotions, en passant, castling) should be probed with execute_move.
+    """
+    piece = pos.board[fromidx >> 3][fromidx & 7]
+    assert piece is not None
+    frombit, tobit = 1 << fromidx, 1 << toidx
+    bbs = dict(pos.bitboards)
+    for key, mask in bbs.items():
+        if mask & tobit:
+            bbs[key] = mask & ~tobit
+    key = str(piece)
+    bbs[key] = bbs[key] & ~frombit | tobit
+    white, black = pos.occupancy
+    occ = (white | black) & ~frombit | tobit
+    if color == Color.WHITE:
+        kings, q = bbs.get("K", 0), bbs.get("q", 0)
+        masks = bbs.get("p", 0), bbs.get("n", 0), bbs.get("b", 0) | q, bbs.get("r", 0) | q, bbs.get("k", 0)
+    else:
+        kings, q = bbs.get("k", 0), bbs.get("Q", 0)
+        masks = bbs.get("P", 0), bbs.get("N", 0), bbs.get("B", 0) | q, bbs.get("R", 0) | q, bbs.get("K", 0)
+    by = 1 - color_index(color)
+    for idx in iter_bits(kings):
+        if attacked(idx, occ, *masks, by):
+            return True
+    return False
@@ -7,10 +7,14 @@ import queue
 
 from typing import Optional, Iterable, Iterator, Dict, Any, Callable, Union, TYPE_CHECKING
 
-from .state import Position, Move, BoardAction, GameEndValue, Color
+from .state import Position, GameState, intern_position, Move, BoardAction, GameEndValue, Color, Square
 from .variant import Variant
+from .tree import CompactTree, CompactNode
+from .movecache import MoveIndex
+from .speculate import Speculator
 
 if TYPE_CHECKING:
+    from .journal import Journal
     from .uci import UCIEngine, Score
     from .gui.widgets import ChessTimer
 
@@ -62,34 +66,110 @@ class TimeControl:
 
 
 class GameTree:
-    def __init__(self, current: Position):
-        self.pos = current
+    """
+    A node of the game tree.
+    A tree created with transpositions merges them: positions are interned, and every node is indexed by its position,
+    so a move leading to a position already in the tree links to the existing node, making the tree a DAG.
+    Such a node, and the extras stored on it, is shared by all lines reaching it, parent and move describe the first one.
+    Positions are indexed with their ply, so every line to a node has the same length and the DAG has no cycles.
+    """
+
+    def __init__(self, current: Position, parent: Optional[GameTree] = None, move: Optional[Move] = None, transpositions: bool = False):
+        self.parent = parent
+        self.move = move  # The move leading here from the parent, None at the root
+        self.depth: int = 0 if parent is None else parent.depth + 1  # Plies from the root
         self.next_moves: Dict[Move, GameTree] = {}
         self.extra: Dict[str, Any] = {}
         self.pv_move: Optional[Move] = None
+        # Nodes by interned position, shared by the whole tree, None if transpositions are not merged
+        self._index: Optional[Dict[Position, GameTree]] = parent._index if parent is not None else {} if transpositions else None
+        self._journal: Optional[Journal] = parent._journal if parent is not None else None
+        if self._index is not None:
+            current = intern_position(current)
+            self._index.setdefault(current, self)
+        self.pos = current
 
     def add_move(self, move: Move, to: Position) -> None:
-        self.next_moves[move] = GameTree(to)
+        node = None
+        if self._index is not None:
+            node = self._index.get(intern_position(to))
+        if node is None:
+            node = GameTree(to, self, move)
+        assert node.depth == self.depth + 1
+        self.next_moves[move] = node
         if self.pv_move is None:
             self.pv_move = move
+        if self._journal is not None:
+            self._journal.added(self, move, node)
+
+    def node_count(self) -> int:
+        """
+        Returns the number of distinct nodes reachable from this one.
+        """
+        seen = {id(self)}
+        stack = [self]
+        while stack:
+            for child in stack.pop().next_moves.values():
+                if id(child) not in seen:
+                    seen.add(id(child))
+                    stack.append(child)
+        return len(seen)
+
+    def root(self) -> GameTree:
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
+
+    def path(self) -> list[Move]:
+        """
+        Returns the moves leading from the root to this node, along the first line that reached it.
+        """
+        moves = []
+        node = self
+        while node.parent is not None:
+            assert node.move is not None
+            moves.append(node.move)
+            node = node.parent
+        moves.reverse()
+        return moves
 
     def set_pv_move(self, move: Move) -> None:
         self.pv_move = move
+        if self._journal is not None:
+            self._journal.pv(self, move)
 
     def set_extra(self, prop: str, data: Any) -> None:
+        # Journaled first: data that can not be serialized raises before the node changes
+        if self._journal is not None:
+            self._journal.extra(self, prop, data)
         self.extra[prop] = data
 
     def get_extra(self, prop: str) -> Any:
         return self.extra.get(prop)
 
 
+# Nodes of either tree storage
+TreeNode = Union[GameTree, CompactNode]
+
+
 class GameController:
-    def __init__(self, variant: Variant, pos: Optional[Position] = None, tc: Optional[TimeControl] = None):
+    def __init__(self, variant: Variant, pos: Optional[Position] = None, tc: Optional[TimeControl] = None, transpositions: bool = False,
+                 compact: bool = False):
         self.variant = variant
         self.root_is_startpos = pos is None
-        self.tree = GameTree(variant.startpos() if pos is None else pos)
+        startpos = variant.startpos() if pos is None else pos
+        self.tree: TreeNode
+        if compact:
+            assert not transpositions, "Compact trees do not merge transpositions"
+            self.tree = CompactTree(variant, startpos).root()
+        else:
+            self.tree = GameTree(startpos, transpositions=transpositions)
         self.current = self.tree
         self.curmoves: list[Move] = []
+        # Nodes from the root to the current one, the line followed might not be the nodes' parents if transpositions are merged
+        self.line: list[TreeNode] = [self.tree]
+        self.game = GameState(variant, self.tree.pos)
         self.uci: Optional[UCIEngine] = None
         self.uci2: Optional[UCIEngine] = None
         self.uci_info_thread: Optional[threading.Thread] = None
@@ -97,6 +177,9 @@ class GameController:
         self.move_thread: Optional[threading.Thread] = None
         self.lastuci: Optional[UCIEngine] = None
         self.analysis_callback: Optional[Callable[[list[tuple[Move, Score]]], None]] = None
+        self.speculator: Optional[Speculator] = None
+        # The reply the engine expects to its last move, speculated on first
+        self.expected_reply: Optional[Move] = None
         self.orig_tc = TimeControl(5.0, 2.0) if tc is None else tc # TODO: Make this default more obvious / configurable
         self.tc = copy.deepcopy(self.orig_tc)
 
@@ -110,30 +193,173 @@ class GameController:
     def root(self) -> None:
         self.current = self.tree
         self.curmoves.clear()
+        self.line = [self.tree]
+        self.game = GameState(self.variant, self.tree.pos)
+        self._speculate()
+
+    def start_journal(self, path: str) -> Journal:
+        """
+        Saves the game tree to a new journal file, every later change to the tree is appended to it.
+        """
+        from . import journal
+        return journal.create(path, self.variant, self.tree)
+
+    def open_journal(self, path: str, compact: bool = True) -> Journal:
+        """
+        Replaces the game tree by the one saved in a journal file, and goes to its root. Later changes are appended to the file.
+        """
+        from . import journal
+        self.tree, jrnl = journal.load(path, self.variant, compact)
+        self.root_is_startpos = self.tree.pos.zobrist == self.variant.startpos().zobrist
+        self.root()
+        return jrnl
 
     def moves(self, moves: Iterable[Move]) -> None:
         for m in moves:
             self.move(m)
 
     def move(self, move: Move) -> tuple[list[BoardAction], Optional[GameEndValue]]:
-        newpos, actions = self.variant.execute_move(self.current.pos, move)
+        nextpos = self.speculator.next_position(self.current.pos, move) if self.speculator is not None else None
+        actions = self.game.push(move, nextpos)
         if self.tc.active:
             self.tc.stop(Color.from_ply(self.current.pos.ply))
 
         if move not in self.current.next_moves:
-            self.current.add_move(move, newpos)
+            self.current.add_move(move, self.game.pos)
         self.current = self.current.next_moves[move]
         self.curmoves.append(move)
-        return actions, self.variant.game_value(self.tree.pos, self.curmoves)
+        self.line.append(self.current)
+        result = self.game.result()
+        if result is None:
+            self._speculate()
+        return actions, result
+
+    def start_speculation(self) -> None:
+        """
+        Starts precomputing, in the background, the positions and legal moves after each move from the current position,
+        so that playing a move finds them ready. Restarted after every move.
+        """
+        if self.speculator is None:
+            self.speculator = Speculator(self.variant)
+            self.speculator.start()
+        self._speculate()
+
+    def stop_speculation(self) -> None:
+        if self.speculator is not None:
+            self.speculator.stop()
+            self.speculator = None
+
+    def _speculate(self) -> None:
+        if self.speculator is None:
+            return
+        likely = [self.expected_reply] if self.expected_reply is not None else []
+        self.expected_reply = None
+        self.speculator.speculate(self.current.pos, likely)
+
+    def game_result(self) -> Optional[GameEndValue]:
+        return self.game.result()
+
+    def repetitions(self) -> int:
+        """
+        How many times the current position occurred along the current line, counting this occurrence.
+        """
+        return self.game.repetitions()
 
     def move_back(self) -> None:
+        self.back()
+
+    def back(self) -> bool:
+        """
+        Steps back one move, returns False if already at the root. Does not execute any moves.
+        """
+        if not self._back():
+            return False
+        self._speculate()
+        return True
+
+    def _back(self) -> bool:
+        if len(self.line) == 1:
+            return False
+        self.game.pop()
         self.curmoves.pop()
-        moves = self.curmoves.copy()
-        self.root()
-        self.moves(moves)
+        self.line.pop()
+        self.current = self.line[-1]
+        return True
+
+    def forward(self, move: Optional[Move] = None) -> bool:
+        """
+        Steps into a move already in the tree, the main line (pv_move) by default.
+        Returns False if there is no such move. Reuses the stored position instead of executing the move.
+        """
+        if move is None:
+            move = self.current.pv_move
+        node = self.current.next_moves.get(move) if move is not None else None
+        if node is None:
+            return False
+        assert move is not None
+        self._enter(move, node)
+        self._speculate()
+        return True
+
+    def goto(self, node: TreeNode) -> None:
+        """
+        Jumps to any node of the tree, stepping back to the common ancestor of the current node and forward from there,
+        along the node's parents. Costs the distance between the two nodes, and does not execute any moves.
+        """
+        down = []
+        while node.depth > self.current.depth:
+            down.append(node)
+            assert node.parent is not None
+            node = node.parent
+        while self.current.depth > node.depth:
+            self._back()
+        while self.current is not node:
+            assert node.parent is not None, "Node is not part of this game's tree"
+            self._back()
+            down.append(node)
+            node = node.parent
+        for n in reversed(down):
+            assert n.move is not None
+            self._enter(n.move, n)
+        self._speculate()
+
+    def _enter(self, move: Move, node: TreeNode) -> None:
+        assert self.current.next_moves.get(move) is node
+        self.game.push(move, node.pos)
+        self.curmoves.append(move)
+        self.line.append(node)
+        self.current = node
+
+    def move_index(self) -> MoveIndex:
+        """
+        The current position's legal moves, indexed by origin and destination square, cached by the variant.
+        """
+        return self.variant.move_index(self.current.pos)
 
     def legal_moves(self) -> Iterator[Move]:
-        return self.variant.legal_moves(self.current.pos)
+        return iter(self.move_index())
+
+    def piece_legal_moves(self, fromsq: Square) -> Iterator[Move]:
+        return iter(self.move_index().from_square(fromsq))
+
+    def engine_bestmove(self, uci: UCIEngine) -> Move:
+        """
+        Searches the current position, returns the engine's move. Raises ValueError if the move is unreadable or illegal.
+        """
+        bestmove = uci.search_sync(self.tc.time, self.tc.inc)
+        try:
+            move = Move.from_uci(bestmove, self.current.pos.ply)
+        except (AssertionError, IndexError, ValueError) as e:
+            raise ValueError(f"Engine sent an unreadable move: {bestmove!r}") from e
+        if not self.variant.is_legal(self.current.pos, move):
+            raise ValueError(f"Engine played an illegal move: {move}")
+        self.expected_reply = None
+        if uci.ponder is not None:
+            try:
+                self.expected_reply = Move.from_uci(uci.ponder, self.current.pos.ply + 1)
+            except (AssertionError, IndexError, ValueError):
+                pass  # Not a move we understand, only a hint anyway
+        return move
 
     def with_engine(self, uci: UCIEngine, uci2: Optional[UCIEngine] = None) -> None:
         assert self.uci is None
@@ -193,7 +419,23 @@ class GameController:
             self.uci2_info_thread = threading.Thread(target=self._uci_info_thread_fn, args=(self.uci2,))
             self.uci2_info_thread.start()
 
-    def engine_move_async(self, cb: Callable[[tuple[list[BoardAction], Optional[GameEndValue]]], None]) -> None:
+    def _play_engine_move(self) -> tuple[list[BoardAction], Optional[GameEndValue]]:
+        assert self.lastuci is not None
+        color = Color.from_ply(self.current.pos.ply)
+        self.tc.start(color)
+        try:
+            move = self.engine_bestmove(self.lastuci)
+        except ValueError:
+            self.tc.stop(color)
+            raise
+        return self.move(move)
+
+    def engine_move_async(self, cb: Callable[[tuple[list[BoardAction], Optional[GameEndValue]]], None],
+                          error_cb: Optional[Callable[[ValueError], None]] = None) -> None:
+        """
+        Lets the engine play a move in a background thread, cb is called with the result.
+        If the engine sends an illegal move, the clock is stopped and error_cb is called instead (the error is printed without one).
+        """
         assert self.uci is not None
         if self.uci_info_thread is None:
             self._start_engine()
@@ -202,10 +444,15 @@ class GameController:
         assert self.lastuci is not None
         self.lastuci.set_position(self.variant.pos_to_fen(self.tree.pos) if not self.root_is_startpos else None, self.curmoves)
         def move_thread_fn() -> None:
-            assert self.lastuci is not None
-            self.tc.start(Color.from_ply(self.current.pos.ply))
-            move = Move.from_uci(self.lastuci.search_sync(self.tc.time, self.tc.inc), self.current.pos.ply)
-            cb(self.move(move))
+            try:
+                result = self._play_engine_move()
+            except ValueError as e:
+                if error_cb is not None:
+                    error_cb(e)
+                else:
+                    print(e)
+                return
+            cb(result)
         self.move_thread = threading.Thread(target=move_thread_fn)
         self.move_thread.start()
 
@@ -217,9 +464,7 @@ class GameController:
             self.lastuci = self.uci if self.current.pos.ply % 2 == 0 else self.uci2
         assert self.lastuci is not None
         self.lastuci.set_position(self.variant.pos_to_fen(self.tree.pos) if not self.root_is_startpos else None, self.curmoves)
-        self.tc.start(Color.from_ply(self.current.pos.ply))
-        move = Move.from_uci(self.lastuci.search_sync(self.tc.time, self.tc.inc), self.current.pos.ply)
-        return self.move(move)
+        return self._play_engine_move()
 
     def engine_analyse(self) -> None:
         assert self.uci is not None
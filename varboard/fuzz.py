@@ -0,0 +1,110 @@
+"""
+Differential fuzzing of the move generation fast paths. Plays random games in every variant and checks that
+is_legal, piece_legal_moves and legal_drops agree with legal_moves, which is what the Variant docstrings require.
+Run `python -m varboard.fuzz --help` for the command line interface.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+from typing import Optional, Iterator
+
+from .perft import VARIANTS
+from .state import Position, Move, Piece, Color, square_grid
+from .variant import Variant
+
+
+def candidate_moves(pos: Position, rng: random.Random, count: int) -> Iterator[Move]:
+    """
+    Yields random, mostly illegal, moves of the side to move: moves and promotions from its pieces, and drops.
+    """
+    my = Color.from_ply(pos.ply)
+    width, height = pos.bounds()
+    squares = [sq for row in square_grid(width, height) for sq in row]
+    origins = [sq for sq, _ in pos.pieces_iter(my)]
+    for _ in range(count):
+        tosq = rng.choice(squares)
+        piece = Piece(rng.choice("PNBRQK"), my) if rng.random() < 0.2 else None
+        if origins and rng.random() < 0.9:
+            yield Move(rng.choice(origins), tosq, piece)
+        else:
+            yield Move.drop_at(tosq, piece or Piece("P", my))
+
+
+def check_position(variant: Variant, pos: Position, rng: random.Random, candidates: int = 64) -> list[str]:
+    """
+    Returns a description of every disagreement between the fast paths and legal_moves in a position.
+    """
+    errors = []
+    fen = variant.pos_to_fen(pos)
+    moves = list(variant.legal_moves(pos))
+    legal = set(moves)
+    if len(legal) != len(moves):
+        errors.append(f"{fen}: legal_moves has duplicates")
+
+    # The fast paths answer from the move cache when the position is in it, which is filled from legal_moves itself,
+    # so it is emptied before each group of checks to test the direct generation
+    cache = variant.move_cache()
+    cache.clear()
+    width, height = pos.bounds()
+    for sq in (sq for row in square_grid(width, height) for sq in row):
+        fast = list(variant.piece_legal_moves(pos, sq))
+        slow = [m for m in moves if m.fromsq == sq]
+        if sorted(m.code for m in fast) != sorted(m.code for m in slow):
+            errors.append(f"{fen}: piece_legal_moves({sq}) gave {sorted(map(str, fast))}, expected {sorted(map(str, slow))}")
+    fast = list(variant.legal_drops(pos))
+    slow = [m for m in moves if m.fromsq is None]
+    if sorted(m.code for m in fast) != sorted(m.code for m in slow):
+        errors.append(f"{fen}: legal_drops gave {sorted(map(str, fast))}, expected {sorted(map(str, slow))}")
+
+    cache.clear()
+    for m in moves:
+        if not variant.is_legal(pos, m):
+            errors.append(f"{fen}: is_legal rejects legal move {m}")
+    for m in candidate_moves(pos, rng, candidates):
+        if variant.is_legal(pos, m) != (m in legal):
+            errors.append(f"{fen}: is_legal({m}) is {m not in legal}, expected {m in legal}")
+    return errors
+
+
+def fuzz(variant: Variant, games: int, max_plies: int, seed: int = 0) -> list[str]:
+    """
+    Plays random games and checks every position on the way, returns the disagreements found.
+    """
+    rng = random.Random(seed)
+    errors = []
+    for _ in range(games):
+        pos = variant.startpos()
+        for _ in range(max_plies):
+            errors += check_position(variant, pos, rng)
+            moves = list(variant.legal_moves(pos))
+            if not moves:
+                break
+            pos, _ = variant.execute_move(pos, rng.choice(moves))
+    return errors
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m varboard.fuzz", description="Check move generation fast paths against legal_moves.")
+    parser.add_argument("variants", nargs="*", metavar="variant", help=f"variants to check, all by default: {', '.join(sorted(VARIANTS))}")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--plies", type=int, default=100, help="longest game to play")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    for name in args.variants:
+        if name not in VARIANTS:
+            parser.error(f"unknown variant {name!r}")
+
+    failed = False
+    for name in args.variants or sorted(VARIANTS):
+        errors = fuzz(VARIANTS[name](), args.games, args.plies, args.seed)
+        print(f"{name}: {len(errors)} disagreements")
+        for e in errors[:20]:
+            print("  " + e)
+        failed |= bool(errors)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from typing import ClassVar, Dict, Tuple
+
+from .state import Square, Color, square_grid
+
+Direction = Tuple[int, int]  # (file, rank) step
+
+KNIGHT_STEPS: Tuple[Direction, ...] = tuple((x, y) for x in (-2, -1, 1, 2) for y in (-2, -1, 1, 2) if abs(x) != abs(y))
+KING_STEPS: Tuple[Direction, ...] = tuple((x, y) for x in (-1, 0, 1) for y in (-1, 0, 1) if x or y)
+BISHOP_DIRECTIONS: Tuple[Direction, ...] = ((-1, -1), (1, -1), (-1, 1), (1, 1))
+ROOK_DIRECTIONS: Tuple[Direction, ...] = ((0, -1), (0, 1), (-1, 0), (1, 0))
+# Diagonally forward steps, left one first
+PAWN_CAPTURE_STEPS: Dict[Color, Tuple[Direction, ...]] = {Color.WHITE: ((-1, 1), (1, 1)), Color.BLACK: ((-1, -1), (1, -1))}
+
+
+class Geometry:
+    """
+    Precomputed square tables for one board size: leaper targets and rays in every direction.
+    Tables are built once per size and shared, use Geometry.of(width, height) to get them.
+    """
+    _cache: ClassVar[Dict[Tuple[int, int], Geometry]] = {}
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        grid = square_grid(width, height)
+        squares = [sq for row in grid for sq in row]
+        self.knight: Dict[Square, Tuple[Square, ...]] = {sq: self._leaps(sq, KNIGHT_STEPS) for sq in squares}
+        self.king: Dict[Square, Tuple[Square, ...]] = {sq: self._leaps(sq, KING_STEPS) for sq in squares}
+        # Diagonally forward squares, indexed [color][square], left one first
+        self.pawn_captures: Dict[Color, Dict[Square, Tuple[Square, ...]]] = {
+            color: {sq: self._leaps(sq, steps) for sq in squares} for color, steps in PAWN_CAPTURE_STEPS.items()
+        }
+        # Squares along a direction, nearest first, indexed [direction][square]
+        self.rays: Dict[Direction, Dict[Square, Tuple[Square, ...]]] = {
+            d: {sq: self._ray(sq, d) for sq in squares} for d in BISHOP_DIRECTIONS + ROOK_DIRECTIONS
+        }
+
+    @staticmethod
+    def of(width: int, height: int) -> Geometry:
+        geo = Geometry._cache.get((width, height))
+        if geo is None:
+            geo = Geometry._cache[width, height] = Geometry(width, height)
+        return geo
+
+    def _inbounds(self, file: int, rank: int) -> bool:
+        return 0 <= file < self.width and 0 <= rank < self.height
+
+    def _leaps(self, sq: Square, steps: Tuple[Direction, ...]) -> Tuple[Square, ...]:
+        return tuple(Square(sq.rank + y, sq.file + x) for x, y in steps if self._inbounds(sq.file + x, sq.rank + y))
+
+    def _ray(self, sq: Square, d: Direction) -> Tuple[Square, ...]:
+        out = []
+        file, rank = sq.file + d[0], sq.rank + d[1]
+        while self._inbounds(file, rank):
+            out.append(Square(rank, file))
+            file, rank = file + d[0], rank + d[1]
+        return tuple(out)
@@ -185,4 +185,10 @@ class BoardView(tk.Frame):
             self.engine_play = False
 
     def automove(self) -> None:
-        self.controller.engine_move_async(self.didmove)
+        self.controller.engine_move_async(self.didmove, self.engine_failed)
+
+    def engine_failed(self, error: ValueError) -> None:
+        # An illegal move forfeits the game
+        print("Engine error:", error)
+        tkinter.messagebox.showerror("Engine error", str(error))
+        self.end_game(GameEndValue.win_for(~Color.from_ply(self.controller.current.pos.ply)))
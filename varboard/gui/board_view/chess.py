@@ -6,6 +6,7 @@ from typing import Any, Union, Optional, TYPE_CHECKING
 from . import BoardView
 from ..promotion_window import PromotionWindow
 from ..widgets import PieceView
+from ...state import Square
 
 if TYPE_CHECKING:
     from ..widgets import SquareView
@@ -68,46 +69,40 @@ class ChessBoardView(BoardView):
 
     def handle_square_btn(self, square: Union[SquareView, PieceView], x: int, y: int) -> None:
         print(f"Clicked {x}, {y}, last {self.last_clicked}")
-        allmoves = []
-        movesto = []
-        movesfrom = []
-        for m in self.controller.legal_moves():
-            allmoves.append(m)
-            assert m.tosq is not None
-            assert m.fromsq is not None
-            if m.tosq.to_tuple() == (x, y): movesto.append(m)
-            if m.fromsq.to_tuple() == (x, y): movesfrom.append(m)
-        for sq in set(m.tosq for m in allmoves):
-            self.set_color(sq, None)
-        moves = []
+        index = self.controller.move_index()
         if self.last_clicked:
-            moves = [m for m in movesto if m.fromsq is not None and m.fromsq.to_tuple() == self.last_clicked]
-        else:
-            if len(set(m.fromsq for m in movesto)) == 1:  # Unique move to
-                if len(movesto) > 1:
-                    self.do_promotion_move(movesto)
-                elif len(movesto):
-                    self.domove(movesto[0])
-                return
-            elif len(set(m.tosq for m in movesfrom)) == 1:  # unique move from
-                if len(movesfrom) > 1:
-                    self.do_promotion_move(movesfrom)
-                elif len(movesfrom):
-                    self.domove(movesfrom[0])
-                return
-
-            # first click, many options
-            for m in movesfrom:
-                self.set_color(m.tosq, "pale green" if (m.tosq.rank + m.tosq.file) % 2 == 1 else "lime green")
-            if len(movesfrom) > 0:
-                self.last_clicked = (x, y)
+            # Second click, only the moves of the selected piece matter
+            movesfrom = list(index.from_square(Square.from_tuple(self.last_clicked)))
+            for sq in set(m.tosq for m in movesfrom):
+                self.set_color(sq, None)
+            moves = [m for m in movesfrom if m.tosq.to_tuple() == (x, y)]
+            if len(moves) > 1:
+                self.do_promotion_move(moves)
+            elif len(moves):
+                self.domove(moves[0])
+            self.last_clicked = None
+            return
+
+        movesto = list(index.to_square(Square.from_tuple((x, y))))
+        movesfrom = list(index.from_square(Square.from_tuple((x, y))))
+        if len(set(m.fromsq for m in movesto)) == 1:  # Unique move to
+            if len(movesto) > 1:
+                self.do_promotion_move(movesto)
+            elif len(movesto):
+                self.domove(movesto[0])
+            return
+        elif len(set(m.tosq for m in movesfrom)) == 1:  # unique move from
+            if len(movesfrom) > 1:
+                self.do_promotion_move(movesfrom)
+            elif len(movesfrom):
+                self.domove(movesfrom[0])
             return
 
-        if len(moves) > 1:
-            self.do_promotion_move(moves)
-        elif len(moves):
-            self.domove(moves[0])
-        self.last_clicked = None
+        # first click, many options
+        for m in movesfrom:
+            self.set_color(m.tosq, "pale green" if (m.tosq.rank + m.tosq.file) % 2 == 1 else "lime green")
+        if len(movesfrom) > 0:
+            self.last_clicked = (x, y)
 
     def select_promotion(self, chosen_piece: Piece) -> None:
         self.promotion_choice = chosen_piece
@@ -0,0 +1,112 @@
+"""
+Opt-in call counters for the hot paths of a Variant: number of calls and cumulative time spent, per variant and method.
+enable(variant) shadows the methods with timing wrappers on that one instance, disable(variant) removes them again,
+so variants that are not instrumented run the plain methods without any overhead.
+Times are inclusive, a legal_moves call also counts the time of the is_in_check calls it makes.
+Time spent by generators (like legal_moves) is measured while they produce values, not while the caller consumes them.
+Counting is thread-safe, calls made by the speculator thread are counted together with those of the GUI.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import threading
+import time
+import types
+from typing import Any, Callable, Iterator
+
+from .variant import Variant
+
+INSTRUMENTED = ("legal_moves", "execute_move", "is_in_check", "target_squares", "game_value", "game_result")
+
+
+class Counter:
+    __slots__ = ("calls", "seconds")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.seconds = 0.0
+
+    def add(self, calls: int, seconds: float) -> None:
+        with _lock:
+            self.calls += calls
+            self.seconds += seconds
+
+
+# Counters by variant UCI name, then method name
+_counters: dict[str, dict[str, Counter]] = {}
+# Guards every counter update and read, instrumented methods may be called from several threads
+_lock = threading.Lock()
+
+
+def _timed_iter(it: Iterator[Any], counter: Counter) -> Iterator[Any]:
+    while True:
+        start = time.perf_counter()
+        try:
+            value = next(it)
+        except StopIteration:
+            counter.add(0, time.perf_counter() - start)
+            return
+        counter.add(0, time.perf_counter() - start)
+        yield value
+
+
+def _timed(fn: Callable[..., Any], counter: Counter) -> Callable[..., Any]:
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            counter.add(1, time.perf_counter() - start)
+        if isinstance(result, types.GeneratorType):
+            return _timed_iter(result, counter)
+        return result
+    return wrapper
+
+
+def enable(variant: Variant) -> None:
+    """
+    Starts counting calls on a variant instance. Instances of the same variant share counters.
+    """
+    counters = _counters.setdefault(variant.uci_name(), {})
+    for name in INSTRUMENTED:
+        if name in vars(variant) or not hasattr(variant, name):
+            continue
+        setattr(variant, name, _timed(getattr(variant, name), counters.setdefault(name, Counter())))
+
+
+def disable(variant: Variant) -> None:
+    """
+    Stops counting calls on a variant instance, the counters keep their values.
+    """
+    for name in INSTRUMENTED:
+        vars(variant).pop(name, None)
+
+
+def is_enabled(variant: Variant) -> bool:
+    return any(name in vars(variant) for name in INSTRUMENTED)
+
+
+def counters() -> dict[str, dict[str, dict[str, float]]]:
+    """
+    Returns a snapshot of the counters: {variant: {method: {"calls": ..., "seconds": ...}}}.
+    """
+    with _lock:
+        return {variant: {name: {"calls": c.calls, "seconds": c.seconds} for name, c in methods.items()}
+                for variant, methods in _counters.items()}
+
+
+def reset() -> None:
+    """
+    Sets all counters to zero, instrumented variants keep counting.
+    """
+    with _lock:
+        for methods in _counters.values():
+            for c in methods.values():
+                c.calls = 0
+                c.seconds = 0.0
+
+
+def to_json() -> str:
+    return json.dumps(counters(), indent=2, sort_keys=True)
@@ -0,0 +1,213 @@
+"""
+Append-only journal of a game tree, so long analysis sessions and matches survive a crash and saving costs only the changes.
+The file is JSON lines: a header, then one record per tree change, appended (and flushed) as it happens.
+Nodes are numbered in the order they were created, the root is 0.
+
+    {"journal": 1, "variant": "chess", "fen": null, "transpositions": false}   FEN of the root, null for the start position
+    {"add": 0, "move": "e2e4", "node": 1}                                      add_move from node 0, reaching node 1
+    {"pv": 0, "move": "e2e4"}                                                  set_pv_move
+    {"extra": 1, "prop": "comment", "data": "best by test"}                    set_extra, the data must be JSON serializable
+
+In trees merging transpositions, an "add" record can reach a node created before.
+Loading streams the records, and by default builds a CompactTree, whose positions are only computed when accessed.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Optional, Any, Dict, Iterator, TextIO, Union, TYPE_CHECKING
+
+from .state import Move, Position
+from .tree import CompactTree, CompactNode
+from .variant import Variant
+
+if TYPE_CHECKING:
+    from .controller import GameTree, TreeNode
+
+VERSION = 1
+
+
+class Journal:
+    """
+    Writes the records of one tree. Trees with a journal attached report their changes to it:
+    GameTree nodes are passed in as they are and numbered by the journal, CompactTree nodes by their index.
+    """
+
+    def __init__(self, f: TextIO, sync: bool = False):
+        self.f = f
+        self.sync = sync
+        self._ids: Dict[GameTree, int] = {}
+        self._next_id = 1
+
+    def _write(self, record: dict[str, Any]) -> None:
+        self.f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.f.flush()
+        if self.sync:
+            os.fsync(self.f.fileno())
+
+    def _ref(self, node: Union[GameTree, int]) -> int:
+        if isinstance(node, int):
+            return node
+        ref = self._ids.get(node)
+        if ref is None:
+            ref = self._ids[node] = 0 if node.parent is None else self._next_id
+            if ref:
+                self._next_id += 1
+        return ref
+
+    def added(self, parent: Union[GameTree, int], move: Move, child: Union[GameTree, int]) -> None:
+        self._write({"add": self._ref(parent), "move": move.to_uci(), "node": self._ref(child)})
+
+    def pv(self, node: Union[GameTree, int], move: Move) -> None:
+        self._write({"pv": self._ref(node), "move": move.to_uci()})
+
+    def extra(self, node: Union[GameTree, int], prop: str, data: Any) -> None:
+        self._write({"extra": self._ref(node), "prop": prop, "data": data})
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def _header(variant: Variant, root: Position, transpositions: bool) -> dict[str, Any]:
+    fen = None if root.zobrist == variant.startpos().zobrist else variant.pos_to_fen(root)
+    return {"journal": VERSION, "variant": variant.uci_name(), "fen": fen, "transpositions": transpositions}
+
+
+def create(path: str, variant: Variant, root: TreeNode, sync: bool = False) -> Journal:
+    """
+    Writes a tree to a new journal file, and attaches the journal to the tree, so its later changes are appended.
+    With sync, every record is fsynced, not only flushed.
+    """
+    journal = Journal(open(path, "w"), sync)
+    if isinstance(root, CompactNode):
+        tree = root.tree
+        journal._write(_header(variant, root.pos, False))
+        for idx in range(1, len(tree)):
+            journal.added(tree.parent(idx), tree.move(idx), idx)  # type: ignore
+        for idx in range(len(tree)):
+            # The first child is the main line unless set otherwise
+            pv = tree.pv(idx)
+            if pv >= 0 and pv != next(tree.children(idx))[1]:
+                journal.pv(idx, tree.move(pv))  # type: ignore
+        # Only the nodes that have extras are in the sparse column
+        for idx, extra in tree._extras.items():
+            for prop, data in extra.items():
+                journal.extra(idx, prop, data)
+        tree.journal = journal
+        return journal
+
+    journal._write(_header(variant, root.pos, root._index is not None))
+    journal._ref(root)
+    # Breadth first, so parents are numbered before their children
+    queue = [root]
+    for node in queue:
+        node._journal = journal
+        for move, child in node.next_moves.items():
+            new = child not in journal._ids
+            journal.added(node, move, child)
+            if new:
+                queue.append(child)
+    for node in queue:
+        # The first move added is the main line unless set otherwise
+        if node.pv_move is not None and node.pv_move != next(iter(node.next_moves)):
+            journal.pv(node, node.pv_move)
+        for prop, data in node.extra.items():
+            journal.extra(node, prop, data)
+    return journal
+
+
+def records(path: str) -> Iterator[dict[str, Any]]:
+    """
+    Reads the records of a journal one at a time, the header first.
+    A truncated last line, as left by a crash while writing, is ignored.
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
+
+
+def _drop_partial_line(path: str) -> None:
+    """
+    Cuts off a last line left incomplete by a crash, so appended records start on a line of their own.
+    """
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - 4096)
+            f.seek(start)
+            nl = f.read(pos - start).rfind(b"\n")
+            if nl >= 0:
+                pos = start + nl + 1
+                break
+            pos = start
+        if pos != end:
+            f.truncate(pos)
+
+
+def load(path: str, variant: Variant, compact: bool = True, sync: bool = False) -> tuple[TreeNode, Journal]:
+    """
+    Rebuilds a tree from a journal, returns its root and the journal, reopened to append further changes to the tree.
+    Compact trees (the default) are built without executing any moves, positions are computed when accessed.
+    Journals of trees merging transpositions can only be loaded into a GameTree.
+    """
+    from .controller import GameTree
+
+    it = records(path)
+    header = next(it)
+    if header.get("journal") != VERSION:
+        raise ValueError(f"Not a version {VERSION} journal: {path}")
+    if header["variant"] != variant.uci_name():
+        raise ValueError(f"Journal is for {header['variant']}, not {variant.uci_name()}")
+    transpositions = header["transpositions"]
+    if compact and transpositions:
+        raise ValueError("Journals of trees merging transpositions can not be loaded into a compact tree")
+    startpos = variant.startpos() if header["fen"] is None else variant.pos_from_fen(header["fen"])
+
+    nodes: list[TreeNode] = []
+    tree: Optional[CompactTree] = None
+    if compact:
+        tree = CompactTree(variant, startpos)
+    else:
+        nodes.append(GameTree(startpos, transpositions=transpositions))
+    for record in it:
+        if "add" in record:
+            parent = record["add"]
+            if tree is not None:
+                move = Move.from_uci(record["move"], startpos.ply + tree.depth(parent))
+                idx = tree.add_child(parent, move)
+                assert idx == record["node"], f"Journal node {record['node']} loaded as {idx}"
+                continue
+            node = nodes[parent]
+            move = Move.from_uci(record["move"], node.pos.ply)
+            node.add_move(move, variant.execute_move(node.pos, move)[0])
+            child = node.next_moves[move]
+            if record["node"] == len(nodes):
+                nodes.append(child)
+            assert nodes[record["node"]] is child, f"Journal node {record['node']} reached by another position"
+        elif "pv" in record:
+            ref = record["pv"]
+            if tree is not None:
+                tree.set_pv(ref, Move.from_uci(record["move"], startpos.ply + tree.depth(ref)))
+            else:
+                nodes[ref].set_pv_move(Move.from_uci(record["move"], nodes[ref].pos.ply))
+        elif "extra" in record:
+            if tree is not None:
+                tree.set_extra(record["extra"], record["prop"], record["data"])
+            else:
+                nodes[record["extra"]].set_extra(record["prop"], record["data"])
+        else:
+            raise ValueError(f"Unknown journal record: {record!r}")
+
+    _drop_partial_line(path)
+    journal = Journal(open(path, "a"), sync)
+    if tree is not None:
+        tree.journal = journal
+        return tree.root(), journal
+    journal._ids = {node: i for i, node in enumerate(nodes)}  # type: ignore
+    journal._next_id = len(nodes)
+    for node in nodes:
+        node._journal = journal  # type: ignore
+    return nodes[0], journal
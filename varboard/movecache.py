@@ -0,0 +1,130 @@
+"""
+Cache of generated legal moves for the positions recently queried by the GUI and the controller.
+Each entry indexes the moves by origin square, destination square and dropped piece,
+so asking for the moves of one piece or onto one square is a dictionary lookup instead of a scan of the whole list.
+Search loops (perft, engines) should keep calling Variant.legal_moves, which is not cached.
+"""
+from __future__ import annotations
+
+import collections
+import threading
+from typing import Optional, Iterable, Iterator, Dict, Tuple, TYPE_CHECKING
+
+from .state import Position, Move, Square, Piece, same_position
+
+if TYPE_CHECKING:
+    from .variant import Variant
+
+
+class MoveIndex:
+    """
+    The legal moves of a position, in generation order, indexed by origin square (None for drops),
+    destination square and dropped piece.
+    """
+    __slots__ = ("moves", "_from", "_to", "_drops", "_set")
+
+    def __init__(self, moves: Iterable[Move]):
+        self.moves = tuple(moves)
+        by_from: Dict[Optional[Square], list[Move]] = {}
+        by_to: Dict[Square, list[Move]] = {}
+        drops: Dict[Piece, list[Move]] = {}
+        for m in self.moves:
+            by_from.setdefault(m.fromsq, []).append(m)
+            if m.tosq is not None:
+                by_to.setdefault(m.tosq, []).append(m)
+            if m.fromsq is None and m.intopiece is not None:
+                drops.setdefault(m.intopiece, []).append(m)
+        self._from = {sq: tuple(ms) for sq, ms in by_from.items()}
+        self._to = {sq: tuple(ms) for sq, ms in by_to.items()}
+        self._drops = {p: tuple(ms) for p, ms in drops.items()}
+        self._set = frozenset(self.moves)
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    def __iter__(self) -> Iterator[Move]:
+        return iter(self.moves)
+
+    def __contains__(self, move: Move) -> bool:
+        return move in self._set
+
+    def from_square(self, sq: Optional[Square]) -> Tuple[Move, ...]:
+        """
+        Moves of the piece on a square, or all drops for None.
+        """
+        return self._from.get(sq, ())
+
+    def to_square(self, sq: Square) -> Tuple[Move, ...]:
+        return self._to.get(sq, ())
+
+    def drops(self, piece: Optional[Piece] = None) -> Tuple[Move, ...]:
+        """
+        Drops of a given piece, or all drops.
+        """
+        if piece is None:
+            return self._from.get(None, ())
+        return self._drops.get(piece, ())
+
+
+class MoveCache:
+    """
+    A bounded LRU of MoveIndex entries, keyed by zobrist key. Entries are checked against the full position,
+    so a key collision is a miss, not a wrong answer. Safe to use from several threads.
+    """
+
+    def __init__(self, variant: Variant, size: int = 64):
+        self.variant = variant
+        self.size = size
+        # Room kept on top of size, see reserve
+        self.reserved = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: collections.OrderedDict[int, Tuple[Position, MoveIndex]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, pos: Position) -> Optional[MoveIndex]:
+        """
+        Returns the cached index of a position, or None without generating anything.
+        """
+        with self._lock:
+            entry = self._entries.get(pos.zobrist)
+            if entry is None or not same_position(entry[0], pos):
+                return None
+            self._entries.move_to_end(pos.zobrist)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, pos: Position, index: MoveIndex) -> None:
+        with self._lock:
+            self._entries[pos.zobrist] = (pos, index)
+            self._entries.move_to_end(pos.zobrist)
+            while len(self._entries) > max(self.size, self.reserved):
+                self._entries.popitem(last=False)
+
+    def index(self, pos: Position) -> MoveIndex:
+        """
+        Returns the index of a position's legal moves, generating and caching it on a miss.
+        """
+        index = self.peek(pos)
+        if index is None:
+            # Generated outside of the lock, so other threads are not blocked meanwhile
+            index = MoveIndex(self.variant.legal_moves(pos))
+            with self._lock:
+                self.misses += 1
+            self.put(pos, index)
+        return index
+
+    def reserve(self, entries: int) -> None:
+        """
+        Keeps at least this many entries until reserved again, such as a position and all of its children
+        which would otherwise evict each other on positions with many moves. Reserve 0 to shrink back to size.
+        """
+        with self._lock:
+            self.reserved = entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
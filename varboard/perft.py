@@ -0,0 +1,270 @@
+"""
+Perft: counts the leaf nodes of the legal move tree to a fixed depth.
+The counts are a correctness oracle for move generation and their rate a throughput benchmark.
+Run `python -m varboard.perft --help` for the command line interface.
+"""
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+from typing import Optional, Callable, Iterator
+
+from .state import Position, Move
+from .variant import Variant, Chess, NoCastleChess, PawnsOnly, RacingKings, TicTacToe
+
+VARIANTS: dict[str, Callable[[], Variant]] = {v().uci_name(): v for v in (Chess, NoCastleChess, PawnsOnly, RacingKings, TicTacToe)}
+
+# Subtree node counts, keyed by (zobrist, depth)
+PerftTable = dict[tuple[int, int], int]
+
+# Known node counts for test positions, by variant: (FEN or None for the start position, counts for depth 1, 2, ...)
+KNOWN: dict[str, list[tuple[Optional[str], tuple[int, ...]]]] = {
+    "chess": [
+        (None, (20, 400, 8902, 197281, 4865609)),
+        # "Kiwipete", castling, en passant and promotions
+        ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", (48, 2039, 97862, 4085603)),
+        ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", (14, 191, 2812, 43238, 674624)),
+        ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", (6, 264, 9467, 422333)),
+        ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", (44, 1486, 62379, 2103487)),
+        ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", (46, 2079, 89890, 3894594)),
+    ],
+    "nocastle": [
+        (None, (20, 400, 8902, 197281, 4865609)),
+    ],
+    "pawnsonly": [
+        (None, (16, 256, 3846, 57744, 815968)),
+    ],
+    "racingkings": [
+        (None, (21, 421, 11264, 296242)),
+    ],
+    "tictactoe": [
+        (None, (9, 72, 504, 3024, 15120)),
+    ],
+}
+
+
+def perft(variant: Variant, pos: Position, depth: int, table: Optional[PerftTable] = None) -> int:
+    """
+    Returns the number of move sequences of the given length playable from a position.
+    If a table is given, subtree counts are stored in it and repeated subtrees (transpositions) are looked up instead of walked.
+    """
+    if depth <= 0:
+        return 1
+    if depth == 1:
+        return sum(1 for _ in variant.legal_moves(pos))
+    if table is not None:
+        nodes = table.get((pos.zobrist, depth))
+        if nodes is not None:
+            return nodes
+    nodes = 0
+    for m in variant.legal_moves(pos):
+        nextpos, _ = variant.execute_move(pos, m)
+        nodes += perft(variant, nextpos, depth - 1, table)
+    if table is not None:
+        table[pos.zobrist, depth] = nodes
+    return nodes
+
+
+def divide(variant: Variant, pos: Position, depth: int, table: Optional[PerftTable] = None) -> list[tuple[Move, int]]:
+    """
+    Returns the perft count below each legal move of the position, useful to find the move a generator gets wrong.
+    """
+    assert depth >= 1
+    out = []
+    for m in variant.legal_moves(pos):
+        nextpos, _ = variant.execute_move(pos, m)
+        out.append((m, perft(variant, nextpos, depth - 1, table)))
+    return out
+
+
+# Per worker process state of parallel_perft: the variant, the root position and the worker's transposition table
+_worker: Optional[tuple[Variant, Position, Optional[PerftTable]]] = None
+
+
+def _init_worker(variant_type: type[Variant], fen: str, use_hash: bool) -> None:
+    global _worker
+    variant = variant_type()
+    _worker = (variant, variant.pos_from_fen(fen), {} if use_hash else None)
+
+
+def _perft_task(task: tuple[tuple[int, ...], int]) -> int:
+    assert _worker is not None
+    variant, pos, table = _worker
+    codes, depth = task
+    for code in codes:
+        pos, _ = variant.execute_move(pos, Move.from_code(code))
+    return perft(variant, pos, depth, table)
+
+
+def split_moves(variant: Variant, pos: Position, plies: int) -> Iterator[tuple[tuple[int, ...], Position]]:
+    """
+    Yields every sequence of the given number of legal moves, as packed move codes, with the position it leads to.
+    """
+    if plies <= 0:
+        yield (), pos
+        return
+    for m in variant.legal_moves(pos):
+        nextpos, _ = variant.execute_move(pos, m)
+        for codes, leaf in split_moves(variant, nextpos, plies - 1):
+            yield (m.code,) + codes, leaf
+
+
+def parallel_divide(variant: Variant, pos: Position, depth: int, workers: Optional[int] = None, split: int = 1,
+                    use_hash: bool = False) -> list[tuple[Move, int]]:
+    """
+    Same as divide, but the subtrees below the first `split` plies are counted across a process pool.
+    Workers receive the root position once, as a FEN, and each subtree as a tuple of move codes leading to it.
+    With use_hash, every worker keeps its own transposition table across the subtrees it counts.
+    """
+    assert depth >= 1
+    split = max(1, min(split, depth))
+    tasks = [codes for codes, _ in split_moves(variant, pos, split)]
+    workers = workers or os.cpu_count() or 1
+    # Several chunks per worker, so uneven subtrees still balance out
+    chunksize = max(1, len(tasks) // (workers * 8))
+    out: dict[int, int] = {m.code: 0 for m in variant.legal_moves(pos)}
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                initargs=(type(variant), variant.pos_to_fen(pos), use_hash)) as pool:
+        for codes, nodes in zip(tasks, pool.map(_perft_task, ((codes, depth - split) for codes in tasks), chunksize=chunksize)):
+            out[codes[0]] += nodes
+    return [(Move.from_code(code), nodes) for code, nodes in out.items()]
+
+
+def parallel_perft(variant: Variant, pos: Position, depth: int, workers: Optional[int] = None, split: int = 1,
+                   use_hash: bool = False) -> int:
+    """
+    Same as perft, counted across a process pool, see parallel_divide.
+    """
+    if depth <= 1:
+        return perft(variant, pos, depth)
+    return sum(nodes for _, nodes in parallel_divide(variant, pos, depth, workers, split, use_hash))
+
+
+def known_positions(variant_name: str) -> list[tuple[Position, tuple[int, ...]]]:
+    """
+    Returns the test positions with known node counts for a variant, see KNOWN.
+    """
+    variant = VARIANTS[variant_name]()
+    return [(variant.startpos() if fen is None else variant.pos_from_fen(fen), counts) for fen, counts in KNOWN.get(variant_name, [])]
+
+
+def run_suite(max_nodes: int = 1000000, use_hash: bool = False, out: Callable[[str], None] = print) -> bool:
+    """
+    Checks every known node count up to max_nodes, reporting each result. Returns whether all counts matched.
+    """
+    ok = True
+    for name in KNOWN:
+        variant = VARIANTS[name]()
+        for pos, counts in known_positions(name):
+            for depth, expected in enumerate(counts, 1):
+                if expected > max_nodes:
+                    break
+                start = time.perf_counter()
+                nodes = perft(variant, pos, depth, {} if use_hash else None)
+                elapsed = time.perf_counter() - start
+                status = "ok" if nodes == expected else f"FAIL, expected {expected}"
+                out(f"{name} {variant.pos_to_fen(pos)} depth {depth}: {nodes} nodes, {nps(nodes, elapsed)} nps, {status}")
+                ok &= nodes == expected
+    return ok
+
+
+# Variants python-chess also implements, by uci_name, with the name of their board class
+PYTHON_CHESS_BOARDS = {"chess": "chess.Board", "racingkings": "chess.variant.RacingKingsBoard"}
+
+
+def python_chess_divide(variant_name: str, fen: str, depth: int) -> dict[str, int]:
+    """
+    Returns the perft count below each root move, keyed by UCI move, as computed by python-chess.
+    Needs the chess package to be installed, which is only used for cross-checking move generation.
+    """
+    import importlib
+    module, _, name = PYTHON_CHESS_BOARDS[variant_name].rpartition(".")
+    board = getattr(importlib.import_module(module), name)(fen)
+
+    def count(depth: int) -> int:
+        if depth <= 0:
+            return 1
+        nodes = 0
+        for m in board.legal_moves:
+            board.push(m)
+            nodes += count(depth - 1)
+            board.pop()
+        return nodes
+
+    out = {}
+    for m in list(board.legal_moves):
+        board.push(m)
+        out[m.uci()] = count(depth - 1)
+        board.pop()
+    return out
+
+
+def cross_check(variant: Variant, pos: Position, depth: int, out: Callable[[str], None] = print) -> bool:
+    """
+    Compares divide against python-chess, reporting every root move whose count differs. Returns whether all counts matched.
+    """
+    ours = {m.to_uci().lower(): n for m, n in divide(variant, pos, depth)}
+    theirs = python_chess_divide(variant.uci_name(), variant.pos_to_fen(pos), depth)
+    for move in sorted(ours.keys() | theirs.keys()):
+        if ours.get(move) != theirs.get(move):
+            out(f"{move}: {ours.get(move)}, python-chess {theirs.get(move)}")
+    return ours == theirs
+
+
+def nps(nodes: int, elapsed: float) -> str:
+    return f"{nodes / elapsed:.0f}" if elapsed > 0 else "inf"
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m varboard.perft", description="Count move tree leaves of a variant.")
+    parser.add_argument("variant", nargs="?", default="chess", choices=sorted(VARIANTS))
+    parser.add_argument("depth", nargs="?", type=int, default=3)
+    parser.add_argument("--fen", help="start from this position instead of the variant's start position")
+    parser.add_argument("--divide", action="store_true", help="print the node count below each root move")
+    parser.add_argument("--hash", action="store_true", help="skip repeated subtrees using a transposition table")
+    parser.add_argument("--suite", action="store_true", help="check the known node counts of every variant")
+    parser.add_argument("--python-chess", action="store_true",
+                        help="compare the counts below each root move with python-chess (must be installed)")
+    parser.add_argument("--max-nodes", type=int, default=1000000, help="largest known count to check in --suite")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="count subtrees in this many processes, 0 for one per CPU")
+    parser.add_argument("--split", type=int, default=1, help="plies expanded before handing subtrees to the workers")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.max_nodes, args.hash) else 1
+
+    variant = VARIANTS[args.variant]()
+    pos = variant.pos_from_fen(args.fen) if args.fen else variant.startpos()
+    if args.python_chess:
+        if args.variant not in PYTHON_CHESS_BOARDS:
+            parser.error(f"python-chess does not implement {args.variant}")
+        try:
+            ok = cross_check(variant, pos, args.depth)
+        except ImportError:
+            parser.error("--python-chess needs the chess package, pip install chess")
+        print("Counts match python-chess" if ok else "Counts differ from python-chess")
+        return 0 if ok else 1
+    table: Optional[PerftTable] = {} if args.hash else None
+    start = time.perf_counter()
+    if args.divide or args.workers != 1:
+        if args.workers != 1:
+            counts = parallel_divide(variant, pos, args.depth, args.workers or None, args.split, args.hash)
+        else:
+            counts = divide(variant, pos, args.depth, table)
+        if args.divide:
+            for m, n in counts:
+                print(f"{m}: {n}")
+        nodes = sum(n for _, n in counts)
+    else:
+        nodes = perft(variant, pos, args.depth, table)
+    elapsed = time.perf_counter() - start
+    print(f"Nodes: {nodes}")
+    print(f"Time: {elapsed:.3f}s, {nps(nodes, elapsed)} nps")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
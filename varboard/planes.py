@@ -0,0 +1,133 @@
+"""
+Encodes positions as stacks of feature planes for ML pipelines: an array of shape (N, planes, H, W), plane [rank][file]
+following Position.board, so rank 0 (white's home rank) is row 0.
+Positions are consumed in chunks, so they can be streamed from a generator without holding all of them in memory.
+"""
+from __future__ import annotations
+
+import itertools
+from typing import Iterable, Iterator, Optional, Any
+
+import numpy as np
+
+from .state import Position, Color, HandType
+
+
+class PlaneEncoder:
+    """
+    Plane layout, see plane_names():
+    one plane per piece type and color (white first) with ones where such a piece stands,
+    a plane of ones if white is to move, four planes of ones for the castling rights (white short, white long, black short, black long),
+    a plane with a one on the en passant square, and one plane per piece type and color filled with the number of those pieces in hand.
+    """
+
+    def __init__(self, piece_types: str = "PNBRQK", size: tuple[int, int] = (8, 8), dtype: Any = np.float32):
+        self.piece_types = piece_types
+        self.width, self.height = size
+        self.dtype = dtype
+        self._type_index = {ty: i for i, ty in enumerate(piece_types)}
+        # First plane of each group
+        self.piece_planes = 0
+        self.side_plane = 2 * len(piece_types)
+        self.castle_planes = self.side_plane + 1
+        self.ep_plane = self.castle_planes + 4
+        self.hand_planes = self.ep_plane + 1
+        self.planes = self.hand_planes + 2 * len(piece_types)
+
+    def plane_names(self) -> list[str]:
+        names = [f"piece {ty if color == Color.WHITE else ty.lower()}" for color in (Color.WHITE, Color.BLACK) for ty in self.piece_types]
+        names += ["white to move", "castle K", "castle Q", "castle k", "castle q", "en passant"]
+        names += [f"hand {ty if color == Color.WHITE else ty.lower()}" for color in (Color.WHITE, Color.BLACK) for ty in self.piece_types]
+        return names
+
+    def shape(self, n: int) -> tuple[int, int, int, int]:
+        return (n, self.planes, self.height, self.width)
+
+    def _plane(self, ty: str, color: Color, base: int) -> int:
+        idx = self._type_index.get(ty)
+        if idx is None:
+            raise ValueError(f"Piece type {ty!r} is not encoded, encoder has {self.piece_types!r}")
+        return base + idx + (len(self.piece_types) if color == Color.BLACK else 0)
+
+    def encode_into(self, positions: Iterable[Position], out: np.ndarray) -> int:
+        """
+        Encodes positions into the leading entries of a preallocated array, returns how many were written.
+        Stops when the array is full, so a generator can be passed to fill it chunk by chunk.
+        """
+        assert out.shape[1:] == self.shape(0)[1:], f"Expected planes of shape {self.shape(0)[1:]}, got {out.shape[1:]}"
+        idx_n: list[int] = []
+        idx_plane: list[int] = []
+        idx_rank: list[int] = []
+        idx_file: list[int] = []
+        side = []
+        castle = []
+        hands: list[tuple[int, int]] = []
+        for n, pos in enumerate(itertools.islice(positions, len(out))):
+            assert pos.bounds() == (self.width, self.height), f"Expected a {self.width}x{self.height} board"
+            for sq, p in pos.piece_list():
+                idx_n.append(n)
+                idx_plane.append(self._plane(p.ty, p.color, self.piece_planes))
+                idx_rank.append(sq.rank)
+                idx_file.append(sq.file)
+            side.append(Color.from_ply(pos.ply) == Color.WHITE)
+            rights: Optional[tuple[int, int]] = pos.get_extra("castle")
+            wc, bc = rights or (0, 0)
+            castle.append((wc & 1, wc & 2, bc & 1, bc & 2))
+            ep = pos.get_extra("ep")
+            if ep is not None:
+                idx_n.append(n)
+                idx_plane.append(self.ep_plane)
+                idx_rank.append(ep.rank)
+                idx_file.append(ep.file)
+            hand: Optional[HandType] = pos.get_extra("hand")
+            if hand is not None:
+                for held in hand:
+                    for p in held:
+                        hands.append((n, self._plane(p.ty, p.color, self.hand_planes)))
+        count = len(side)
+
+        view = out[:count]
+        view.fill(0)
+        view[idx_n, idx_plane, idx_rank, idx_file] = 1
+        view[:, self.side_plane] = np.array(side, dtype=self.dtype)[:, None, None]
+        view[:, self.castle_planes:self.castle_planes + 4] = (np.array(castle).reshape(count, 4) != 0)[:, :, None, None]
+        for i, plane in hands:
+            view[i, plane] += 1
+        return count
+
+    def iter_chunks(self, positions: Iterable[Position], chunk_size: int = 1024, reuse: bool = False) -> Iterator[np.ndarray]:
+        """
+        Yields the encoded positions in arrays of up to chunk_size entries.
+        With reuse, every chunk is a view of the same buffer, which is overwritten by the next chunk.
+        """
+        it = iter(positions)
+        buf = np.empty(self.shape(chunk_size), dtype=self.dtype)
+        while True:
+            if not reuse:
+                buf = np.empty(self.shape(chunk_size), dtype=self.dtype)
+            count = self.encode_into(it, buf)
+            if not count:
+                return
+            yield buf[:count]
+            if count < chunk_size:
+                return
+
+    def encode(self, positions: Iterable[Position], count: Optional[int] = None, chunk_size: int = 1024) -> np.ndarray:
+        """
+        Encodes positions into a single array. If the number of positions is known (count, or the iterable's length),
+        the array is allocated once and filled in place, otherwise chunks are concatenated.
+        """
+        if count is None and hasattr(positions, "__len__"):
+            count = len(positions)  # type: ignore
+        if count is None:
+            chunks = list(self.iter_chunks(positions, chunk_size))
+            return np.concatenate(chunks) if chunks else np.empty(self.shape(0), dtype=self.dtype)
+        out = np.empty(self.shape(count), dtype=self.dtype)
+        it = iter(positions)
+        filled = 0
+        while filled < count:
+            written = self.encode_into(it, out[filled:filled + chunk_size])
+            if not written:
+                break
+            filled += written
+        return out[:filled]
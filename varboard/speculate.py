@@ -0,0 +1,92 @@
+"""
+Speculative move generation: while the player to move is thinking, a background thread precomputes what playing each move
+will need, the resulting position and its legal moves (which also decide whether the game ended).
+Legal moves are published into the variant's MoveCache, positions into the speculator's own cache,
+so after the actual move is played, the controller only has to look them up.
+Likely moves (such as the reply an engine expects) are worked on first, and every new request cancels the previous one.
+"""
+from __future__ import annotations
+
+import collections
+import queue
+import threading
+from typing import Optional, Sequence, Tuple
+
+from .state import Position, Move, same_position
+from .variant import Variant
+
+
+class Speculator:
+    def __init__(self, variant: Variant, size: int = 256):
+        self.variant = variant
+        self.size = size
+        self.computed = 0
+        # Positions after a move, keyed by the parent's zobrist key and the move, with the parent to check it
+        self._children: collections.OrderedDict[Tuple[int, Move], Tuple[Position, Position]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: queue.SimpleQueue[Optional[Tuple[int, Position, Sequence[Move]]]] = queue.SimpleQueue()
+        # Bumped by every request, workers drop requests that are not the latest
+        self._generation = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="speculator", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._generation += 1
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self.variant.move_cache().reserve(0)
+
+    def speculate(self, pos: Position, likely: Sequence[Move] = ()) -> None:
+        """
+        Starts precomputing the positions reachable from pos in one move, likely moves first, cancelling earlier requests.
+        """
+        self._generation += 1
+        self._queue.put((self._generation, pos, likely))
+
+    def next_position(self, pos: Position, move: Move) -> Optional[Position]:
+        """
+        Returns the precomputed position after a move, or None if it was not computed (yet).
+        """
+        with self._lock:
+            entry = self._children.get((pos.zobrist, move))
+            if entry is None or not same_position(entry[0], pos):
+                return None
+            self._children.move_to_end((pos.zobrist, move))
+            return entry[1]
+
+    def _publish(self, pos: Position, move: Move, child: Position) -> None:
+        with self._lock:
+            self._children[pos.zobrist, move] = (pos, child)
+            self._children.move_to_end((pos.zobrist, move))
+            if len(self._children) > self.size:
+                self._children.popitem(last=False)
+            self.computed += 1
+
+    def _run(self) -> None:
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            generation, pos, likely = request
+            if generation != self._generation:
+                continue
+            index = self.variant.move_index(pos)
+            # Room for the position and every child, so the entries warmed first are not evicted by the last ones
+            self.variant.move_cache().reserve(len(index) + 1)
+            moves = [m for m in likely if m in index]
+            first = set(moves)
+            moves += [m for m in index if m not in first]
+            for m in moves:
+                if generation != self._generation:
+                    break
+                if self.next_position(pos, m) is not None:
+                    continue
+                child, _ = self.variant.execute_move(pos, m)
+                self.variant.move_index(child)
+                self._publish(pos, m, child)
@@ -1,18 +1,54 @@
 from __future__ import annotations
 
+import array
+import bisect
 import enum
-from typing import Optional, Union, Tuple, List, Dict, Iterator, Any
+import operator
+import weakref
+from typing import Optional, Union, Tuple, List, Dict, FrozenSet, Iterator, Iterable, Sequence, Any, ClassVar, TYPE_CHECKING
+
+from . import zobrist
+
+if TYPE_CHECKING:
+    from .variant import Variant
 
 
 class Square:
+    """
+    A board coordinate. Squares are interned, constructing the same coordinate twice returns the same object,
+    so equality is an identity check. Squares are immutable.
+    The squares of every board geometry in use (see square_grid) are kept for good, other coordinates,
+    like the off-board ones move generation steps onto, are only interned while they are referenced.
+    """
     FILES = "abcdefghijklmnopqrstuvwxyz"
-
-    def __init__(self, rank: int, file: int):
-        self.rank = rank
-        self.file = file
+    __slots__ = ("rank", "file", "_hash", "_code", "__weakref__")
+    _interned: ClassVar[Dict[Tuple[int, int], Square]] = {}
+    _transient: ClassVar[weakref.WeakValueDictionary[Tuple[int, int], Square]] = weakref.WeakValueDictionary()
+    rank: int
+    file: int
+    _hash: int
+    _code: int
+
+    def __new__(cls, rank: int, file: int) -> Square:
+        sq = Square._interned.get((rank, file)) or Square._transient.get((rank, file))
+        if sq is None:
+            sq = object.__new__(cls)
+            object.__setattr__(sq, "rank", rank)
+            object.__setattr__(sq, "file", file)
+            object.__setattr__(sq, "_hash", hash((file, rank)))
+            # 10-bit index used for packing moves, boards up to 32x32 are supported
+            object.__setattr__(sq, "_code", rank << 5 | file if 0 <= rank < 32 and 0 <= file < 32 else -1)
+            Square._transient[(rank, file)] = sq
+        return sq
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("Square is immutable")
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (Square, (self.rank, self.file))
 
     def offset(self, x: int, y: int) -> Square:
-        return Square(self.rank + y, self.file + x)
+        return Square._interned.get((self.rank + y, self.file + x)) or Square(self.rank + y, self.file + x)
 
     @staticmethod
     def from_algebraic(s: str) -> Square:
@@ -30,16 +66,29 @@ class Square:
     def __str__(self) -> str:
         return Square.FILES[self.file] + str(self.rank + 1)
 
-    def __eq__(self, other: Any) -> bool:
-        return isinstance(other, Square) and self.rank == other.rank and self.file == other.file
-
     def __hash__(self) -> int:
-        return hash(self.to_tuple())
+        return self._hash
 
     def to_tuple(self) -> Tuple[int, int]:
         return (self.file, self.rank)
 
 
+_grids: Dict[Tuple[int, int], Tuple[Tuple[Square, ...], ...]] = {}
+
+
+def square_grid(width: int, height: int) -> Tuple[Tuple[Square, ...], ...]:
+    """
+    Returns the interned squares of a board geometry, indexed [rank][file].
+    """
+    grid = _grids.get((width, height))
+    if grid is None:
+        grid = _grids[width, height] = tuple(tuple(Square(rank, file) for file in range(width)) for rank in range(height))
+        for row in grid:
+            for sq in row:
+                Square._interned[sq.rank, sq.file] = sq
+    return grid
+
+
 class Color(enum.Enum):
     BLACK = "b"
     WHITE = "w"
@@ -63,16 +112,54 @@ class GameEndValue(enum.Enum):
 
 
 class Piece:
-    def __init__(self, piecetype: str, color: Color):
-        self.ty = piecetype.upper()
-        self.color = color
-        assert self.ty != self.ty.lower()
+    """
+    A piece type and color. Pieces are interned like Squares, so equality is an identity check. Pieces are immutable.
+    """
+    __slots__ = ("ty", "color", "_str", "_hash", "_code")
+    _interned: ClassVar[Dict[Tuple[str, Color], Piece]] = {}
+    ty: str
+    color: Color
+    _str: str
+    _hash: int
+    _code: int
+
+    def __new__(cls, piecetype: str, color: Color) -> Piece:
+        p = Piece._interned.get((piecetype, color))
+        if p is None:
+            ty = piecetype.upper()
+            assert ty != ty.lower()
+            p = Piece._interned.get((ty, color))
+            if p is None:
+                p = object.__new__(cls)
+                object.__setattr__(p, "ty", ty)
+                object.__setattr__(p, "color", color)
+                object.__setattr__(p, "_str", ty.upper() if color == Color.WHITE else ty.lower())
+                object.__setattr__(p, "_hash", hash(ty) * 1000000007 + hash(color) * 9876543211)
+                # 6-bit index used for packing moves, only single letter piece types are supported
+                code = ord(ty) - ord("A") + 1 | (32 if color == Color.BLACK else 0) if len(ty) == 1 and "A" <= ty <= "Z" else -1
+                object.__setattr__(p, "_code", code)
+                Piece._interned[(ty, color)] = p
+            Piece._interned[(piecetype, color)] = p
+        return p
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("Piece is immutable")
+
+    @staticmethod
+    def from_code(code: int) -> Piece:
+        """
+        Inverse of the piece's 6-bit packed index.
+        """
+        return Piece(chr(ord("A") + (code & 31) - 1), Color.BLACK if code & 32 else Color.WHITE)
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (Piece, (self.ty, self.color))
 
     def __hash__(self) -> int:
-        return hash(self.ty) * 1000000007 + hash(self.color) * 9876543211
+        return self._hash
 
     def __str__(self) -> str:
-        return self.ty.upper() if self.color == Color.WHITE else self.ty.lower()
+        return self._str
 
     def __repr__(self) -> str:
         return f"Piece({self.ty!r}, {self.color})"
@@ -84,67 +171,344 @@ TimerType = Union[int, tuple[int, int]]
 TimeIncType = Union[int, tuple[int, int]]
 
 
+class ExtraSchema:
+    """
+    Fixed slot layout of a position's extras: property names in slot order, and their precomputed indices.
+    Schemas are interned by their property names, and adding a property to a schema is cached,
+    so every position of a variant shares the same few schemas and only stores a tuple of values.
+    Properties in `unkeyed` are bookkeeping: they are left out of the zobrist key and of same_position.
+    """
+    __slots__ = ("props", "index", "unkeyed", "keyed", "_extended")
+    _interned: ClassVar[Dict[Tuple[Tuple[str, ...], FrozenSet[str]], ExtraSchema]] = {}
+    props: Tuple[str, ...]
+    index: Dict[str, int]
+    unkeyed: FrozenSet[str]
+    # Slot indices of the other properties
+    keyed: Tuple[int, ...]
+    _extended: Dict[Tuple[str, bool], ExtraSchema]
+
+    def __new__(cls, props: Tuple[str, ...] = (), unkeyed: FrozenSet[str] = frozenset()) -> ExtraSchema:
+        schema = ExtraSchema._interned.get((props, unkeyed))
+        if schema is None:
+            assert len(set(props)) == len(props), "Duplicate extra property"
+            assert unkeyed <= set(props), "Unkeyed extra property without a slot"
+            schema = object.__new__(cls)
+            schema.props = props
+            schema.index = {prop: i for i, prop in enumerate(props)}
+            schema.unkeyed = unkeyed
+            schema.keyed = tuple(i for i, prop in enumerate(props) if prop not in unkeyed)
+            schema._extended = {}
+            ExtraSchema._interned[props, unkeyed] = schema
+        return schema
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (ExtraSchema, (self.props, self.unkeyed))
+
+    def __repr__(self) -> str:
+        if self.unkeyed:
+            return f"ExtraSchema({self.props!r}, {set(self.unkeyed)!r})"
+        return f"ExtraSchema({self.props!r})"
+
+    def extend(self, prop: str, keyed: bool = True) -> ExtraSchema:
+        """
+        Returns the schema with one more slot, for the given property, at the end.
+        """
+        schema = self._extended.get((prop, keyed))
+        if schema is None:
+            unkeyed = self.unkeyed if keyed else self.unkeyed | {prop}
+            schema = self._extended[prop, keyed] = ExtraSchema(self.props + (prop,), unkeyed)
+        return schema
+
+    def keyed_items(self, extra: Tuple[Any, ...]) -> Dict[str, Any]:
+        """
+        The keyed properties of a tuple of extras laid out by this schema, with their values.
+        """
+        return {self.props[i]: extra[i] for i in self.keyed}
+
+
+_board_order = operator.attrgetter("rank", "file")
+
+
+def _mask_squares(mask: int) -> Tuple[Square, ...]:
+    """
+    Returns the squares of the set bits of an 8x8 occupancy mask, in board order.
+    """
+    grid = square_grid(8, 8)
+    squares = []
+    while mask:
+        low = mask & -mask
+        idx = low.bit_length() - 1
+        squares.append(grid[idx >> 3][idx & 7])
+        mask ^= low
+    return tuple(squares)
+
+
+def _bitboard_locations(board: Sequence[Sequence[Optional[Piece]]], bitboards: Dict[str, int]) -> Dict[Piece, Tuple[Square, ...]]:
+    """
+    Returns the squares of every piece kind on an 8x8 board, read from its bitboards instead of tracked separately.
+    """
+    locations = {}
+    for mask in bitboards.values():
+        squares = _mask_squares(mask)
+        piece = board[squares[0].rank][squares[0].file]
+        assert piece is not None
+        locations[piece] = squares
+    return locations
+
+
 class PositionBuilder:
+    """
+    Builds a Position, from scratch or as a modified copy of another one (from_position).
+    Copies share the unchanged parts of the original: board rows, piece lists and bitboards are only copied when first changed,
+    so deriving a position from another allocates in proportion to the squares changed, not to the board size.
+    """
+
     def __init__(self, size: Tuple[int, int] = (8, 8), ply: int = 0):
         w, h = size
-        self.board: List[List[Optional[Piece]]] = [[None for x in range(w)] for y in range(h)]
+        # Rows are tuples while shared with a position, and replaced by lists when first changed
+        self.board: List[Sequence[Optional[Piece]]] = [[None for x in range(w)] for y in range(h)]
+        self._owned_rows = set(range(h))
         self._ply = ply
-        self._extra: Dict[str, Any] = {}
+        self._schema = ExtraSchema()
+        self._extra: List[Any] = []
+        self._bitboards: Optional[Dict[str, int]] = None
+        self._occupancy = (0, 0)
+        # Squares of every piece kind on the board, in board order. None while bitboards are kept, they hold the same
+        self._locations: Optional[Dict[Piece, Tuple[Square, ...]]] = {}
+        # Whether _locations and _bitboards are shared with a position, and must be copied before changing them
+        self._shared = False
+        # Kept up to date by every piece/extra/ply change, so deriving a position from another costs O(changes)
+        self._zobrist = zobrist.SIDE_KEY if ply % 2 else 0
 
     @staticmethod
     def from_position(pos: Position) -> PositionBuilder:
-        bld = PositionBuilder((0, 0), pos.ply)
-        bld.board = [list(row) for row in pos.board]
-        for k, v in pos.extra:
-            bld.extra(k, v)
+        bld = PositionBuilder.__new__(PositionBuilder)
+        bld.board = list(pos.board)
+        bld._owned_rows = set()
+        bld._ply = pos.ply
+        bld._schema = pos.schema
+        bld._extra = list(pos.extra)
+        if isinstance(pos, BitboardPosition):
+            bld._bitboards = pos.bitboards
+            bld._occupancy = pos.occupancy
+            bld._locations = None
+        else:
+            bld._bitboards = None
+            bld._occupancy = (0, 0)
+            bld._locations = pos._locations
+        bld._shared = True
+        bld._zobrist = pos.zobrist
         return bld
 
     def ply(self, ply: int) -> PositionBuilder:
         assert ply >= 0
+        if (ply ^ self._ply) & 1:
+            self._zobrist ^= zobrist.SIDE_KEY
         self._ply = ply
         return self
 
+    def bitboards(self) -> PositionBuilder:
+        """
+        Makes this builder produce a BitboardPosition, which additionally tracks occupancy masks for every piece.
+        Only 8x8 boards are supported.
+        """
+        assert len(self.board) == 8 and all(len(row) == 8 for row in self.board), "Bitboards require an 8x8 board"
+        self._bitboards = {}
+        white = black = 0
+        for rank, row in enumerate(self.board):
+            for file, p in enumerate(row):
+                if p is not None:
+                    key = str(p)
+                    bit = 1 << (rank * 8 + file)
+                    self._bitboards[key] = self._bitboards.get(key, 0) | bit
+                    if p.color == Color.WHITE:
+                        white |= bit
+                    else:
+                        black |= bit
+        self._occupancy = (white, black)
+        self._locations = None
+        return self
+
+    def _row(self, rank: int) -> List[Optional[Piece]]:
+        """
+        Returns a row to change, copying it first if it is shared.
+        """
+        row = self.board[rank]
+        if rank not in self._owned_rows:
+            row = self.board[rank] = list(row)
+            self._owned_rows.add(rank)
+        return row  # type: ignore
+
+    def _unshare(self) -> None:
+        if self._shared:
+            if self._locations is not None:
+                self._locations = self._locations.copy()
+            if self._bitboards is not None:
+                self._bitboards = self._bitboards.copy()
+            self._shared = False
+
     def piece(self, pos: Square, piece: Optional[Piece]) -> PositionBuilder:
         """
         Sets a piece at a given coordinate in this position
         """
-        self.board[pos.rank][pos.file] = piece
+        rank, file = pos.rank, pos.file
+        old = self.board[rank][file]
+        if old is piece:
+            return self
+        row = self._row(rank)
+        self._unshare()
+        locations = self._locations
+        if old is not None:
+            self._zobrist ^= zobrist.piece_key(old._str, rank, file)
+            if locations is not None:
+                squares = tuple(sq for sq in locations[old] if sq is not pos)
+                if squares:
+                    locations[old] = squares
+                else:
+                    del locations[old]
+        if piece is not None:
+            self._zobrist ^= zobrist.piece_key(piece._str, rank, file)
+            if locations is not None:
+                held = locations.get(piece)
+                if held:
+                    added = list(held)
+                    bisect.insort(added, pos, key=_board_order)
+                    locations[piece] = tuple(added)
+                else:
+                    locations[piece] = (pos,)
+        bitboards = self._bitboards
+        if bitboards is not None:
+            bit = 1 << (rank * 8 + file)
+            white, black = self._occupancy
+            if old is not None:
+                mask = bitboards[old._str] & ~bit
+                if mask:
+                    bitboards[old._str] = mask
+                else:
+                    del bitboards[old._str]
+                if old.color == Color.WHITE:
+                    white &= ~bit
+                else:
+                    black &= ~bit
+            if piece is not None:
+                bitboards[piece._str] = bitboards.get(piece._str, 0) | bit
+                if piece.color == Color.WHITE:
+                    white |= bit
+                else:
+                    black |= bit
+            self._occupancy = (white, black)
+        row[file] = piece
         return self
 
-    def extra(self, prop: str, data: Any) -> PositionBuilder:
+    def _move(self, fromsq: Square, tosq: Square) -> None:
+        """
+        Moves a piece to another square, capturing what stands there. Same as two piece() calls, in one pass over the tables.
+        """
+        piece = self.board[fromsq.rank][fromsq.file]
+        if piece is None or fromsq is tosq:
+            self.piece(fromsq, None)
+            self.piece(tosq, piece)
+            return
+        if self.board[tosq.rank][tosq.file] is not None:
+            self.piece(tosq, None)
+        fromrank, fromfile, torank, tofile = fromsq.rank, fromsq.file, tosq.rank, tosq.file
+        self._row(fromrank)[fromfile] = None
+        self._row(torank)[tofile] = piece
+        self._unshare()
+        key = piece._str
+        self._zobrist ^= zobrist.piece_key(key, fromrank, fromfile) ^ zobrist.piece_key(key, torank, tofile)
+        locations = self._locations
+        if locations is not None:
+            squares = locations[piece]
+            if len(squares) == 1:
+                locations[piece] = (tosq,)
+            else:
+                moved = list(squares)
+                moved.remove(fromsq)
+                bisect.insort(moved, tosq, key=_board_order)
+                locations[piece] = tuple(moved)
+        bitboards = self._bitboards
+        if bitboards is not None:
+            bits = 1 << (fromrank * 8 + fromfile) | 1 << (torank * 8 + tofile)
+            bitboards[key] ^= bits
+            white, black = self._occupancy
+            self._occupancy = (white ^ bits, black) if piece.color == Color.WHITE else (white, black ^ bits)
+
+    def action(self, action: BoardAction) -> PositionBuilder:
+        """
+        Applies a primitive board action, as returned by Variant.move_effects.
+        """
+        if action.fromsq is not None:
+            self._move(action.fromsq, action.tosq)
+        else:
+            self.piece(action.tosq, action.piece)
+        return self
+
+    def extra(self, prop: str, data: Any, keyed: bool = True) -> PositionBuilder:
         """
         Sets a piece of arbitrary data for this position, used for things like the 50-move timer, pieces in hand, en passant, etc.
         The data must be of an immutable and hashable type.
+        Pass keyed=False for bookkeeping that does not change what the position is, like the ply of the last capture:
+        the property is then left out of the zobrist key and of same_position. Only the first setting of a property decides this.
         """
         _ = hash(data)
-        self._extra[prop] = data
+        idx = self._schema.index.get(prop)
+        if idx is None:
+            self._schema = self._schema.extend(prop, keyed)
+            self._extra.append(data)
+        else:
+            old = self._extra[idx]
+            if old is data:
+                return self
+            keyed = prop not in self._schema.unkeyed
+            if keyed:
+                self._zobrist ^= zobrist.extra_key(prop, old)
+            self._extra[idx] = data
+        if keyed:
+            self._zobrist ^= zobrist.extra_key(prop, data)
         return self
 
+    def get_extra(self, prop: str) -> Optional[Any]:
+        idx = self._schema.index.get(prop)
+        return self._extra[idx] if idx is not None else None
+
     def build(self) -> Position:
+        if self._bitboards is not None:
+            return BitboardPosition(self)
         return Position(self)
 
+    def _share(self) -> Tuple[Tuple[Optional[Piece], ...], ...]:
+        """
+        Freezes the changed rows and returns the board, marking everything as shared with the position being built,
+        so changing this builder afterwards copies again instead of modifying that position.
+        """
+        board = self.board
+        for rank in self._owned_rows:
+            board[rank] = tuple(board[rank])
+        self._owned_rows.clear()
+        self._shared = True
+        return tuple(board)  # type: ignore
+
 
 class Position:
     """
     This class is an immutable representation of a chess (variant) position.
-    The "extra" attribute is intentionally extremely generic to support many possible use-cases.
+    The extras are intentionally extremely generic to support many possible use-cases.
+    They are stored as a tuple of values ("extra"), laid out by an interned ExtraSchema ("schema").
+    The "zobrist" attribute is a 64-bit key of the pieces, side to move and keyed extras, stable across processes.
     """
 
     def __init__(self, builder: PositionBuilder):
-        self.board = tuple(tuple(row) for row in builder.board)
+        self.board = builder._share()
         self.ply = builder._ply
-        # Python does NOT have a frozendict(), and the PEP (416) got rejected
-        self.extra = frozenset(builder._extra.items())
-        self._hash: Optional[int] = None
+        self.schema = builder._schema
+        self.extra = tuple(builder._extra)
+        self.zobrist: int = builder._zobrist
+        if builder._locations is not None:
+            self._locations = builder._locations
 
     def __hash__(self) -> int:
-        if self._hash is not None:
-            return self._hash
-        h = (976153908764132 | 1) * hash(self.extra)
-        h += (1072346802467642 | 1) * hash(self.board)
-        h += (7428098251633488 | 1) * hash(self.ply)
-        self._hash = hash(h)
-        return self._hash
+        return self.zobrist
 
     def __str__(self) -> str:
         return "\n".join("".join(str(p) if p is not None else " " for p in r) for r in self.board[::-1])
@@ -162,24 +526,118 @@ class Position:
         return self.board[sq.rank][sq.file]
 
     def get_extra(self, prop: str) -> Optional[Any]:
-        for k, v in self.extra:
-            if k == prop: return v
-        else:
-            return None
+        idx = self.schema.index.get(prop)
+        return self.extra[idx] if idx is not None else None
 
-    def extra_iter(self) -> Iterator[Any]:
-        return iter(self.extra)
+    def extra_iter(self) -> Iterator[Tuple[str, Any]]:
+        return zip(self.schema.props, self.extra)
+
+    def piece_squares(self, piece: Piece) -> Tuple[Square, ...]:
+        """
+        Returns the squares holding the given piece, in board order. Tracked incrementally, does not scan the board.
+        """
+        return self._locations.get(piece, ())
+
+    def piece_list(self, color: Optional[Color] = None) -> List[Tuple[Square, Piece]]:
+        """
+        Returns the pieces (of a given color) on the board, grouped by kind. Costs O(pieces) instead of O(board area).
+        """
+        return [(sq, p) for p, squares in self._locations.items() if color is None or p.color == color for sq in squares]
+
+    def material(self, color: Color) -> Dict[str, int]:
+        """
+        Returns how many pieces of each type the given color has on the board.
+        """
+        return {p.ty: len(squares) for p, squares in self._locations.items() if p.color == color}
 
     def squares_iter(self) -> Iterator[Tuple[Square, Optional[Piece]]]:
-        for rank in range(len(self.board)):
-            for file in range(len(self.board[rank])):
-                yield (Square(rank, file), self.board[rank][file])
+        grid = square_grid(len(self.board[0]), len(self.board))
+        for rank, row in enumerate(self.board):
+            squares = grid[rank]
+            for file, p in enumerate(row):
+                yield (squares[file], p)
 
     def pieces_iter(self, color: Optional[Color] = None) -> Iterator[Tuple[Square, Piece]]:
+        grid = square_grid(len(self.board[0]), len(self.board))
         for rank, row in enumerate(self.board):
+            squares = grid[rank]
             for file, p in enumerate(row):
                 if p is not None and (color is None or p.color == color):
-                    yield (Square(rank, file), p)
+                    yield (squares[file], p)
+
+
+class BitboardPosition(Position):
+    """
+    A Position on an 8x8 board which also keeps an integer occupancy mask for every piece kind and color.
+    Square (rank, file) corresponds to bit rank * 8 + file, the masks are keyed by the piece's FEN letter.
+    Create these using PositionBuilder.bitboards(), see varboard.bitboard for the helpers operating on them.
+    """
+
+    def __init__(self, builder: PositionBuilder):
+        super().__init__(builder)
+        assert builder._bitboards is not None
+        # Masks of the pieces on the board only, shared with the builder. They replace _locations for these positions
+        self.bitboards: Dict[str, int] = builder._bitboards
+        self.occupancy: Tuple[int, int] = builder._occupancy
+
+    def piece_squares(self, piece: Piece) -> Tuple[Square, ...]:
+        return _mask_squares(self.bitboards.get(piece._str, 0))
+
+    def piece_list(self, color: Optional[Color] = None) -> List[Tuple[Square, Piece]]:
+        locations = _bitboard_locations(self.board, self.bitboards)
+        return [(sq, p) for p, squares in locations.items() if color is None or p.color == color for sq in squares]
+
+    def material(self, color: Color) -> Dict[str, int]:
+        locations = _bitboard_locations(self.board, self.bitboards)
+        return {p.ty: len(squares) for p, squares in locations.items() if p.color == color}
+
+    def pieces_iter(self, color: Optional[Color] = None) -> Iterator[Tuple[Square, Piece]]:
+        grid = square_grid(8, 8)
+        white, black = self.occupancy
+        mask = white | black if color is None else white if color == Color.WHITE else black
+        while mask:
+            low = mask & -mask
+            idx = low.bit_length() - 1
+            p = self.board[idx >> 3][idx & 7]
+            assert p is not None
+            yield (grid[idx >> 3][idx & 7], p)
+            mask ^= low
+
+
+# Positions by zobrist key and ply, see intern_position
+_positions: weakref.WeakValueDictionary[Tuple[int, int], Position] = weakref.WeakValueDictionary()
+
+
+def _same_extras(a: Position, b: Position) -> bool:
+    if a.schema is b.schema:
+        if not a.schema.unkeyed:
+            return a.extra == b.extra
+        return all(a.extra[i] == b.extra[i] for i in a.schema.keyed)
+    return a.schema.keyed_items(a.extra) == b.schema.keyed_items(b.extra)
+
+
+def same_position(a: Position, b: Position) -> bool:
+    """
+    Compares two positions by content: pieces, keyed extras, ply and backend. Positions only compare by identity with ==.
+    """
+    return a is b or (a.zobrist == b.zobrist and a.ply == b.ply and type(a) is type(b)
+                      and _same_extras(a, b) and a.board == b.board)
+
+
+def intern_position(pos: Position) -> Position:
+    """
+    Hash-conses positions: returns the one interned position equal to pos (same pieces, keyed extras, ply and backend),
+    interning pos itself if there is none yet. Interned positions are held weakly, they are forgotten once unused.
+    On a zobrist key collision between different positions, pos is returned without being interned.
+    """
+    key = (pos.zobrist, pos.ply)
+    known = _positions.get(key)
+    if known is None:
+        _positions[key] = pos
+        return pos
+    if same_position(known, pos):
+        return known
+    return pos
 
 
 class BoardAction:
@@ -200,6 +658,223 @@ class BoardAction:
         return f"{self.fromsq or self.piece}->{self.tosq}"
 
 
+class SearchBoard:
+    """
+    Mutable companion to Position for search loops.
+    push() applies a move's board actions in place and pop() reverts them, so probing moves does not build a Position per node.
+    It offers the same read methods as Position, so variant code inspecting positions can be given a SearchBoard as well.
+    """
+
+    def __init__(self, variant: Variant, pos: Position):
+        self.variant = variant
+        self._builder = PositionBuilder.from_position(pos)
+        self._stack: List[Tuple[Move, List[Tuple[Square, Optional[Piece]]], ExtraSchema, List[Any], int, int]] = []
+
+    @property
+    def board(self) -> List[Sequence[Optional[Piece]]]:
+        return self._builder.board
+
+    @property
+    def ply(self) -> int:
+        return self._builder._ply
+
+    @property
+    def zobrist(self) -> int:
+        return self._builder._zobrist
+
+    def push(self, move: Move) -> List[BoardAction]:
+        """
+        Plays a move on this board, returns the board actions it consisted of.
+        """
+        bld = self._builder
+        actions, extras = self.variant.move_effects(self, move)
+        undo: List[Tuple[Square, Optional[Piece]]] = []
+        self._stack.append((move, undo, bld._schema, list(bld._extra), bld._zobrist, bld._ply))
+        for a in actions:
+            if a.fromsq is not None:
+                undo.append((a.fromsq, bld.board[a.fromsq.rank][a.fromsq.file]))
+            undo.append((a.tosq, bld.board[a.tosq.rank][a.tosq.file]))
+            bld.action(a)
+        for k, v in extras.items():
+            bld.extra(k, v, k not in self.variant.UNKEYED_EXTRAS)
+        bld.ply(bld._ply + 1)
+        return actions
+
+    def pop(self) -> Move:
+        """
+        Reverts the last pushed move and returns it.
+        """
+        bld = self._builder
+        move, undo, schema, extra, key, ply = self._stack.pop()
+        for sq, p in reversed(undo):
+            bld.piece(sq, p)
+        bld._schema = schema
+        bld._extra = extra
+        bld._zobrist = key
+        bld._ply = ply
+        return move
+
+    def moves(self) -> List[Move]:
+        """
+        Returns the moves pushed so far, oldest first.
+        """
+        return [m for m, *_ in self._stack]
+
+    def snapshot(self) -> Position:
+        """
+        Returns an immutable Position of the current state, using the same backend as the position this board was created from.
+        """
+        return self._builder.build()
+
+    def bounds(self) -> Tuple[int, int]:
+        return (len(self.board[0]), len(self.board))
+
+    def inbounds(self, sq: Square) -> bool:
+        return 0 <= sq.rank < len(self.board) and 0 <= sq.file < len(self.board[0])
+
+    def get_piece(self, sq: Square) -> Optional[Piece]:
+        return self.board[sq.rank][sq.file]
+
+    def get_extra(self, prop: str) -> Optional[Any]:
+        return self._builder.get_extra(prop)
+
+    def extra_iter(self) -> Iterator[Tuple[str, Any]]:
+        return zip(self._builder._schema.props, self._builder._extra)
+
+    def piece_squares(self, piece: Piece) -> Tuple[Square, ...]:
+        """
+        Returns the squares holding the given piece, in board order. Tracked incrementally, does not scan the board.
+        """
+        bld = self._builder
+        if bld._locations is None:
+            assert bld._bitboards is not None
+            return _mask_squares(bld._bitboards.get(piece._str, 0))
+        return bld._locations.get(piece, ())
+
+    def piece_list(self, color: Optional[Color] = None) -> List[Tuple[Square, Piece]]:
+        """
+        Returns the pieces (of a given color) on the board, grouped by kind. Costs O(pieces) instead of O(board area).
+        """
+        return [(sq, p) for p, squares in self._locations().items() if color is None or p.color == color for sq in squares]
+
+    def material(self, color: Color) -> Dict[str, int]:
+        """
+        Returns how many pieces of each type the given color has on the board.
+        """
+        return {p.ty: len(squares) for p, squares in self._locations().items() if p.color == color}
+
+    def _locations(self) -> Dict[Piece, Tuple[Square, ...]]:
+        bld = self._builder
+        if bld._locations is None:
+            assert bld._bitboards is not None
+            return _bitboard_locations(bld.board, bld._bitboards)
+        return bld._locations
+
+    def squares_iter(self) -> Iterator[Tuple[Square, Optional[Piece]]]:
+        grid = square_grid(len(self.board[0]), len(self.board))
+        for rank, row in enumerate(self.board):
+            squares = grid[rank]
+            for file, p in enumerate(row):
+                yield (squares[file], p)
+
+    def pieces_iter(self, color: Optional[Color] = None) -> Iterator[Tuple[Square, Piece]]:
+        grid = square_grid(len(self.board[0]), len(self.board))
+        for rank, row in enumerate(self.board):
+            squares = grid[rank]
+            for file, p in enumerate(row):
+                if p is not None and (color is None or p.color == color):
+                    yield (squares[file], p)
+
+
+# Anything variants can inspect a board through
+BoardState = Union[Position, SearchBoard]
+
+
+class GameState:
+    """
+    A game played from a starting position, advanced one move at a time.
+    Next to the current position, it carries whatever the variant needs to decide the game's result (in "data"),
+    updated by Variant.update_game on every move, so result() does not replay the game like Variant.game_value does.
+    It also counts how often each position (by zobrist key) occurred since the last irreversible move (Variant.is_irreversible),
+    positions before it can not occur again, so they are not kept.
+    """
+
+    def __init__(self, variant: Variant, startpos: Position):
+        self.variant = variant
+        self.startpos = startpos
+        self.pos = startpos
+        # Variant specific end condition state, replaced on every push, so values stored in it must not be mutated
+        self.data: Dict[str, Any] = {}
+        self._result: Optional[GameEndValue] = None
+        self._result_known = False
+        self._counts: Dict[int, int] = {startpos.zobrist: 1}
+        # Per move: the move, the previous position, data and result, and the count table replaced by an irreversible move
+        self._stack: List[Tuple[Move, Position, Dict[str, Any], Optional[GameEndValue], bool, Optional[Dict[int, int]]]] = []
+        variant.init_game(self)
+
+    @property
+    def ply(self) -> int:
+        return self.pos.ply
+
+    def push(self, move: Move, nextpos: Optional[Position] = None) -> List[BoardAction]:
+        """
+        Plays a move, returns the board actions it consisted of.
+        If the resulting position is already known (nextpos), it is used instead of building it again.
+        """
+        prev = self.pos
+        if nextpos is None:
+            self.pos, actions = self.variant.execute_move(prev, move)
+        else:
+            actions, _ = self.variant.move_effects(prev, move)
+            self.pos = nextpos
+        counts = None
+        if self.variant.is_irreversible(prev, move, actions):
+            counts = self._counts
+            self._counts = {self.pos.zobrist: 1}
+        else:
+            self._counts[self.pos.zobrist] = self._counts.get(self.pos.zobrist, 0) + 1
+        self._stack.append((move, prev, self.data, self._result, self._result_known, counts))
+        self.data = self.data.copy()
+        self._result_known = False
+        self.variant.update_game(self, prev, move, actions)
+        return actions
+
+    def pop(self) -> Move:
+        """
+        Takes back the last move and returns it.
+        """
+        key = self.pos.zobrist
+        move, self.pos, self.data, self._result, self._result_known, counts = self._stack.pop()
+        if counts is not None:
+            self._counts = counts
+        elif self._counts[key] == 1:
+            del self._counts[key]
+        else:
+            self._counts[key] -= 1
+        return move
+
+    def repetitions(self) -> int:
+        """
+        Returns how many times the current position occurred in this game, counting the current occurrence.
+        """
+        return self._counts[self.pos.zobrist]
+
+    def moves(self) -> List[Move]:
+        """
+        Returns the moves played so far, oldest first.
+        """
+        return [m for m, *_ in self._stack]
+
+    def result(self) -> Optional[GameEndValue]:
+        """
+        Returns the game's value if it is finished, otherwise None. Computed once per position, by Variant.game_result.
+        """
+        if not self._result_known:
+            self._result = self.variant.game_result(self)
+            self._result_known = True
+        return self._result
+
+
 class Move:
     """
     This class represents any chess move in any variant.
@@ -212,6 +887,16 @@ class Move:
     Variants may interpret this differently.
     """
 
+    __slots__ = ("fromsq", "tosq", "intopiece", "code")
+
+    # Layout of the packed integer representation, see Move.code
+    TO_SHIFT = 0
+    FROM_SHIFT = 10
+    PIECE_SHIFT = 20
+    DROP_FLAG = 1 << 26
+    SQUARE_MASK = (1 << 10) - 1
+    PIECE_MASK = (1 << 6) - 1
+
     def __init__(self, fromsq: Optional[Square] = None, tosq: Optional[Square] = None,
                  intopiece: Optional[Piece] = None):
         assert tosq is not None, "Removing pieces not yet supported"
@@ -220,6 +905,39 @@ class Move:
         self.fromsq = fromsq
         self.tosq = tosq
         self.intopiece = intopiece
+        # Packed into a single int: target square, origin square (or the drop flag), promotion/drop piece
+        code = tosq._code
+        if fromsq is None:
+            code |= Move.DROP_FLAG
+        else:
+            code |= fromsq._code << Move.FROM_SHIFT
+        if intopiece is not None:
+            code |= intopiece._code << Move.PIECE_SHIFT
+        if code < 0:  # some part has no packed representation
+            raise ValueError(f"Move cannot be packed: {fromsq!r}, {tosq!r}, {intopiece!r}")
+        self.code: int = code
+
+    @staticmethod
+    def from_code(code: int) -> Move:
+        """
+        Inverse of Move.code.
+        """
+        tosq = Square((code >> 5) & 31, code & 31)
+        fromsq = None
+        if not code & Move.DROP_FLAG:
+            fromcode = (code >> Move.FROM_SHIFT) & Move.SQUARE_MASK
+            fromsq = Square(fromcode >> 5, fromcode & 31)
+        intopiece = None
+        piececode = (code >> Move.PIECE_SHIFT) & Move.PIECE_MASK
+        if piececode:
+            intopiece = Piece.from_code(piececode)
+        return Move(fromsq, tosq, intopiece)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Move) and self.code == other.code
+
+    def __hash__(self) -> int:
+        return self.code
 
     @staticmethod
     def move(fromsq_raw: Union[Square, str], tosq_raw: Union[Square, str]) -> Move:
@@ -288,3 +1006,14 @@ class Move:
         tosq = str(self.tosq) if self.tosq is not None else None
         intopiece = self.intopiece
         return f"Move({fromsq = !r}, {tosq = !r}, {intopiece = !r})"
+
+
+def pack_moves(moves: Iterable[Move]) -> array.array[int]:
+    """
+    Packs moves into a compact array('I') of their codes.
+    """
+    return array.array("I", (m.code for m in moves))
+
+
+def unpack_moves(codes: Iterable[int]) -> List[Move]:
+    return [Move.from_code(c) for c in codes]
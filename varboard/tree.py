@@ -0,0 +1,303 @@
+"""
+Compact game tree storage for large opening trees and imported games.
+Nodes are rows of array-backed columns (packed move, parent, depth, first child, next sibling, main line child),
+so a node costs a few dozen bytes instead of a GameTree object holding a full Position.
+Positions are only stored, packed, for nodes every snapshot_every plies, the others are rebuilt on access by playing
+the moves from the nearest snapshot, and kept in a small LRU cache. Snapshots are taken when a node's position is
+first known, so adding moves without their positions (as when loading a journal) executes no moves.
+CompactNode views offer the GameTree interface, so a GameController can use a compact tree as well.
+"""
+from __future__ import annotations
+
+import array
+import collections
+import types
+import weakref
+from typing import Optional, Any, Dict, Iterator, Mapping, Tuple, Union, TYPE_CHECKING
+
+from .state import Position, BitboardPosition, PositionBuilder, ExtraSchema, Move, Piece, square_grid
+from .variant import Variant
+
+if TYPE_CHECKING:
+    from .journal import Journal
+
+# A position stored in a snapshot: board size, piece codes by square in board order (0 if empty), ply, schema, extras, bitboards
+PackedPosition = Tuple[Tuple[int, int], bytes, int, ExtraSchema, Tuple[Any, ...], bool]
+
+
+def pack_position(pos: Position) -> Optional[PackedPosition]:
+    """
+    Packs a position into bytes and its extras, returns None if it has pieces without a packed code.
+    """
+    codes = bytearray()
+    for row in pos.board:
+        for p in row:
+            if p is None:
+                codes.append(0)
+            elif p._code < 0:
+                return None
+            else:
+                codes.append(p._code)
+    return pos.bounds(), bytes(codes), pos.ply, pos.schema, pos.extra, isinstance(pos, BitboardPosition)
+
+
+def unpack_position(packed: PackedPosition) -> Position:
+    size, codes, ply, schema, extra, bitboards = packed
+    b = PositionBuilder(size, ply)
+    squares = [sq for row in square_grid(*size) for sq in row]
+    for sq, code in zip(squares, codes):
+        if code:
+            b.piece(sq, Piece.from_code(code))
+    for prop, data in zip(schema.props, extra):
+        b.extra(prop, data, prop not in schema.unkeyed)
+    if bitboards:
+        b.bitboards()
+    return b.build()
+
+
+class CompactTree:
+    """
+    A game tree stored in columns, nodes are referred to by index, the root is node 0.
+    Children are kept in insertion order, as a linked list through the next sibling column.
+    """
+
+    def __init__(self, variant: Variant, root: Position, snapshot_every: int = 16, cache_size: int = 1024):
+        assert snapshot_every > 0
+        self.variant = variant
+        self.snapshot_every = snapshot_every
+        self.cache_size = cache_size
+        self._moves = array.array("I", [0])
+        self._parents = array.array("i", [-1])
+        self._depths = array.array("I", [0])
+        self._first_child = array.array("i", [-1])
+        self._next_sibling = array.array("i", [-1])
+        self._pv = array.array("i", [-1])
+        # Sparse columns, only for the nodes that have them
+        self._extras: Dict[int, Dict[str, Any]] = {}
+        # Positions that can not be packed are kept as they are
+        self._snapshots: Dict[int, Union[PackedPosition, Position]] = {}
+        self._cache: collections.OrderedDict[int, Position] = collections.OrderedDict()
+        self._views: weakref.WeakValueDictionary[int, CompactNode] = weakref.WeakValueDictionary()
+        self.journal: Optional[Journal] = None
+        self._snapshot(0, root)
+
+    def __len__(self) -> int:
+        return len(self._moves)
+
+    def _snapshot(self, idx: int, pos: Position) -> None:
+        packed = pack_position(pos)
+        self._snapshots[idx] = packed if packed is not None else pos
+
+    def _remember(self, idx: int, pos: Position) -> None:
+        self._cache[idx] = pos
+        self._cache.move_to_end(idx)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def add_child(self, parent: int, move: Move, pos: Optional[Position] = None) -> int:
+        """
+        Adds a move to a node and returns the child's index, or the existing child's if the move is already there.
+        Pass the resulting position if it is known, otherwise it is only computed when first accessed.
+        """
+        child = self.child(parent, move)
+        if child >= 0:
+            return child
+        idx = len(self._moves)
+        depth = self._depths[parent] + 1
+        self._moves.append(move.code)
+        self._parents.append(parent)
+        self._depths.append(depth)
+        self._first_child.append(-1)
+        self._next_sibling.append(-1)
+        self._pv.append(-1)
+        # Append to the end of the parent's children
+        last = self._first_child[parent]
+        if last < 0:
+            self._first_child[parent] = idx
+            self._pv[parent] = idx
+        else:
+            while self._next_sibling[last] >= 0:
+                last = self._next_sibling[last]
+            self._next_sibling[last] = idx
+        if pos is not None:
+            self._remember(idx, pos)
+            if depth % self.snapshot_every == 0:
+                self._snapshot(idx, pos)
+        if self.journal is not None:
+            self.journal.added(parent, move, idx)
+        return idx
+
+    def children(self, idx: int) -> Iterator[Tuple[Move, int]]:
+        child = self._first_child[idx]
+        while child >= 0:
+            yield Move.from_code(self._moves[child]), child
+            child = self._next_sibling[child]
+
+    def child(self, idx: int, move: Move) -> int:
+        """
+        Returns the index of the child reached by a move, or -1 if there is none.
+        """
+        code = move.code
+        child = self._first_child[idx]
+        while child >= 0 and self._moves[child] != code:
+            child = self._next_sibling[child]
+        return child
+
+    def parent(self, idx: int) -> int:
+        return self._parents[idx]
+
+    def move(self, idx: int) -> Optional[Move]:
+        return Move.from_code(self._moves[idx]) if idx else None
+
+    def depth(self, idx: int) -> int:
+        return self._depths[idx]
+
+    def pv(self, idx: int) -> int:
+        return self._pv[idx]
+
+    def set_pv(self, idx: int, move: Move) -> None:
+        child = self.child(idx, move)
+        assert child >= 0, f"No move {move} from node {idx}"
+        self._pv[idx] = child
+        if self.journal is not None:
+            self.journal.pv(idx, move)
+
+    def set_extra(self, idx: int, prop: str, data: Any) -> None:
+        # Journaled first: data that can not be serialized raises before the tree changes
+        if self.journal is not None:
+            self.journal.extra(idx, prop, data)
+        self._extras.setdefault(idx, {})[prop] = data
+
+    def get_extra(self, idx: int, prop: str) -> Any:
+        extra = self._extras.get(idx)
+        return extra.get(prop) if extra is not None else None
+
+    def path(self, idx: int) -> list[Move]:
+        """
+        Returns the moves leading from the root to a node.
+        """
+        moves = []
+        while idx:
+            moves.append(Move.from_code(self._moves[idx]))
+            idx = self._parents[idx]
+        moves.reverse()
+        return moves
+
+    def position(self, idx: int) -> Position:
+        """
+        Returns a node's position, rebuilding it from the nearest snapshot or cached ancestor if needed.
+        """
+        pos = self._cache.get(idx)
+        if pos is not None:
+            self._cache.move_to_end(idx)
+            return pos
+        line = []
+        node = idx
+        while True:
+            pos = self._cache.get(node)
+            if pos is not None:
+                break
+            snap = self._snapshots.get(node)
+            if snap is not None:
+                pos = unpack_position(snap) if isinstance(snap, tuple) else snap
+                break
+            line.append(node)
+            node = self._parents[node]
+        for node in reversed(line):
+            pos, _ = self.variant.execute_move(pos, Move.from_code(self._moves[node]))
+            self._remember(node, pos)
+            if self._depths[node] % self.snapshot_every == 0:
+                self._snapshot(node, pos)
+        if not line:
+            self._remember(idx, pos)
+        return pos
+
+    def node(self, idx: int) -> CompactNode:
+        """
+        Returns the GameTree-like view of a node. Views are shared while in use, so they can be compared by identity.
+        """
+        view = self._views.get(idx)
+        if view is None:
+            view = self._views[idx] = CompactNode(self, idx)
+        return view
+
+    def root(self) -> CompactNode:
+        return self.node(0)
+
+    def nbytes(self) -> int:
+        """
+        Memory used by the columns and the packed boards of the snapshots, without object overheads, extras and the cache.
+        """
+        columns = (self._moves, self._parents, self._depths, self._first_child, self._next_sibling, self._pv)
+        return sum(c.itemsize * len(c) for c in columns) + sum(len(s[1]) for s in self._snapshots.values() if isinstance(s, tuple))
+
+
+class CompactNode:
+    """
+    A view of a CompactTree node with the GameTree interface.
+    """
+    __slots__ = ("tree", "index", "__weakref__")
+
+    def __init__(self, tree: CompactTree, index: int):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def pos(self) -> Position:
+        return self.tree.position(self.index)
+
+    @property
+    def parent(self) -> Optional[CompactNode]:
+        parent = self.tree.parent(self.index)
+        return self.tree.node(parent) if parent >= 0 else None
+
+    @property
+    def move(self) -> Optional[Move]:
+        return self.tree.move(self.index)
+
+    @property
+    def depth(self) -> int:
+        return self.tree.depth(self.index)
+
+    @property
+    def next_moves(self) -> Dict[Move, CompactNode]:
+        return {m: self.tree.node(child) for m, child in self.tree.children(self.index)}
+
+    @property
+    def pv_move(self) -> Optional[Move]:
+        pv = self.tree.pv(self.index)
+        return self.tree.move(pv) if pv >= 0 else None
+
+    @property
+    def extra(self) -> Mapping[str, Any]:
+        """
+        The node's extras, read-only, change them with set_extra.
+        """
+        return types.MappingProxyType(self.tree._extras.get(self.index) or {})
+
+    def add_move(self, move: Move, to: Position) -> None:
+        self.tree.add_child(self.index, move, to)
+
+    def set_pv_move(self, move: Move) -> None:
+        self.tree.set_pv(self.index, move)
+
+    def set_extra(self, prop: str, data: Any) -> None:
+        self.tree.set_extra(self.index, prop, data)
+
+    def get_extra(self, prop: str) -> Any:
+        return self.tree.get_extra(self.index, prop)
+
+    def root(self) -> CompactNode:
+        return self.tree.root()
+
+    def path(self) -> list[Move]:
+        return self.tree.path(self.index)
+
+    def node_count(self) -> int:
+        count = 0
+        stack = [self.index]
+        while stack:
+            idx = stack.pop()
+            count += 1
+            stack.extend(child for _, child in self.tree.children(idx))
+        return count
@@ -164,7 +164,7 @@ def get_interruptible(q: queue.SimpleQueue[T], pred: Callable[[], bool] = lambda
 
 
 class UCIEngine:
-    def __init__(self, path: str, extra_args: Iterable[str] = ()):
+    def __init__(self, path: str, extra_args: Iterable[str] = (), probe: bool = True):
         self.path: str = path
         self.extra_args: tuple[str, ...] = tuple(extra_args)
         self.engine_process: Optional[subprocess.Popen[bytes]] = None
@@ -178,10 +178,13 @@ class UCIEngine:
         self.uci_info_queue = queue.SimpleQueue[CommandData]()
         self.uci_move_queue = queue.SimpleQueue[CommandData]()
         self.uci_scores: list[Optional[Context]] = [None]
+        # The reply the engine expects to its last best move, if it said
+        self.ponder: Optional[str] = None
 
         self.uci_set_options: dict[str, str] = {}
 
-        self.probe_engine()
+        if probe:
+            self.probe_engine()
 
     def process_line(self, line: bytes) -> None:
         # print("-----")
@@ -309,6 +312,7 @@ class UCIEngine:
         assert raw is not None
         _, ctx = raw
         assert not self.searching
+        self.ponder = ctx.get("ponder")
         # TODO: Return actual Move -- Need ply info somehow
         move: str = ctx["bestmove"]
         return move
@@ -1,49 +1,41 @@
 from __future__ import annotations
 
-from typing import Iterator, Iterable, Optional
+from typing import Iterator, Iterable, Optional, Any
 
-from .state import PositionBuilder, Position, Square, BoardAction, Move, Piece, Color, HandType, GameEndValue
+from . import bitboard
+from .movecache import MoveCache, MoveIndex
+from .geometry import Geometry, Direction, BISHOP_DIRECTIONS, ROOK_DIRECTIONS
+from .state import PositionBuilder, Position, BitboardPosition, SearchBoard, GameState, BoardState, Square, BoardAction, Move, Piece, Color, HandType, GameEndValue
 
 
 def get_kingsq(pos: Position, my: Color) -> tuple[Square, Square]:
-    my_ksq = None
-    opp_ksq = None
-    for sq, p in pos.pieces_iter():
-        if p.ty == "K":
-            if p.color == my:
-                my_ksq = sq
-            else:
-                opp_ksq = sq
-    assert my_ksq is not None
-    assert opp_ksq is not None
-    return my_ksq, opp_ksq
+    my_kings = pos.piece_squares(Piece("K", my))
+    opp_kings = pos.piece_squares(Piece("K", ~my))
+    assert my_kings
+    assert opp_kings
+    return my_kings[-1], opp_kings[-1]
 
 
 def fen_board(pos: Position) -> str:
-    cnt = 0
-    last = None
-    out = ""
-    for sq, p in pos.squares_iter():
-        if last != sq.rank:
-            if cnt:
-                out += str(cnt)
-                cnt = 0
-            if last is not None:
-                out += "/"
-            last = sq.rank
-        if p is None:
-            cnt += 1
-        else:
+    rows = []
+    # FEN lists ranks from the top of the board down
+    for row in reversed(pos.board):
+        out = ""
+        cnt = 0
+        for p in row:
+            if p is None:
+                cnt += 1
+                continue
             if cnt:
                 out += str(cnt)
                 cnt = 0
             pst = str(p)
             assert len(pst) == 1, "Nonstandard length piece types not supported yet"
             out += pst
-    if cnt:
-        out += str(cnt)
-        cnt = 0
-    return out
+        if cnt:
+            out += str(cnt)
+        rows.append(out)
+    return "/".join(rows)
 
 
 def fen_color(pos: Position) -> str:
@@ -64,16 +56,62 @@ def fen_ep(pos: Position) -> str:
     else:
         return "-"
 
+def fen_halfmove(state: Optional[GameState]) -> str:
+    """
+    The halfmove clock of a game, as tracked by Chess.update_game, or 0 without a game.
+    """
+    return str(state.data.get("halfmove", 0)) if state is not None else "0"
+
+
 def fen_move(pos: Position) -> str:
     return str(pos.ply // 2 + 1)
 
 
+def parse_fen_board(board: str) -> PositionBuilder:
+    """
+    Inverse of fen_board, returns a builder with the pieces set up. The board size is taken from the FEN.
+    """
+    rows = []
+    for fenrow in board.split("/"):
+        row: list[Optional[Piece]] = []
+        num = ""
+        for c in fenrow:
+            if c.isdigit():
+                num += c
+                continue
+            if num:
+                row.extend([None] * int(num))
+                num = ""
+            row.append(Piece(c, Color.WHITE if c.isupper() else Color.BLACK))
+        if num:
+            row.extend([None] * int(num))
+        rows.append(row)
+    width = len(rows[0])
+    assert all(len(row) == width for row in rows), f"Ragged FEN board: {board!r}"
+    b = PositionBuilder((width, len(rows)))
+    for rank, row in enumerate(reversed(rows)):
+        for file, p in enumerate(row):
+            if p is not None:
+                b.piece(Square(rank, file), p)
+    return b
+
+
+def parse_fen_ply(color: str, move: str) -> int:
+    return (int(move) - 1) * 2 + (1 if Color(color) == Color.BLACK else 0)
+
+
 class Variant:
     """
     This class is the base class for each game variant.
     A variant needs to implement a few methods necessary to implement the game, such as providing legal moves and deciding whether a game position is won or not.
     """
 
+    # Extras move_effects sets only for bookkeeping, left out of zobrist keys and position equality, see PositionBuilder.extra
+    UNKEYED_EXTRAS = frozenset({"lastcapture"})
+
+    def __init__(self) -> None:
+        self._move_cache = MoveCache(self)
+
     def _is_pos_ended(self, pos: Position) -> bool:
         """
         Internal, abstract function. Implement on a variant to use the default game_value implementation.
@@ -100,23 +138,57 @@ class Variant:
         """
         raise TypeError("Called startpos on Variant base type")
 
-    def pos_to_fen(self, pos: Position) -> str:
+    def pos_to_fen(self, pos: Position, state: Optional[GameState] = None) -> str:
         """
         Returns the FEN representation of the given position, according to current variant.
+        Pass the game that reached the position as state to write its halfmove clock instead of 0.
+        """
+        return f"{fen_board(pos)} {fen_color(pos)} {fen_halfmove(state)} {fen_move(pos)}"
+
+    def pos_from_fen(self, fen: str) -> Position:
+        """
+        Parses a FEN, as returned by pos_to_fen, into a position of the current variant.
         """
-        return f"{fen_board(pos)} {fen_color(pos)} 0 {fen_move(pos)}"
+        board, color, *_, move = fen.split()
+        return parse_fen_board(board).ply(parse_fen_ply(color, move)).build()
 
     def game_value(self, startpos: Position, moves: Iterable[Move]) -> Optional[GameEndValue]:
         """
         Calculates the game's value, if finished, otherwise returns None.
         Prefer to pass a starting position and move sequence to allow implementing rules like three-fold repetition.
+        This replays the moves, games in progress should keep a GameState and call its result() instead.
         """
-        pos = startpos
+        state = GameState(self, startpos)
         for m in moves:
-            pos, _ = self.execute_move(pos, m)
-        if not self._is_pos_ended(pos):
+            state.push(m)
+        return state.result()
+
+    def init_game(self, state: GameState) -> None:
+        """
+        Sets up the variant's end condition state (state.data) for a game starting at state.pos.
+        """
+
+    def update_game(self, state: GameState, prev: Position, move: Move, actions: list[BoardAction]) -> None:
+        """
+        Called by GameState.push after move was played from prev, updates state.data for the new position.
+        Should cost O(1) amortized in the length of the game, never replay it.
+        """
+
+    def is_irreversible(self, prev: Position, move: Move, actions: list[BoardAction]) -> bool:
+        """
+        Returns whether no position before this move (played from prev) can occur again after it, so GameState can forget them when counting repetitions.
+        The default is False, which is always correct but keeps counting every position of the game.
+        """
+        return False
+
+    def game_result(self, state: GameState) -> Optional[GameEndValue]:
+        """
+        Decides the game's value from a GameState, or returns None if the game is not finished.
+        The default implementation looks only at the current position, using _is_pos_ended and _pos_value.
+        """
+        if not self._is_pos_ended(state.pos):
             return None
-        return self._pos_value(pos)
+        return self._pos_value(state.pos)
 
     def legal_moves(self, pos: Position) -> Iterator[Move]:
         """
@@ -130,20 +202,55 @@ class Variant:
         """
         Returns whether a move is legal in a given position or not.
         """
+        return move in self.move_index(pos)
+
+    def has_legal_moves(self, pos: Position) -> bool:
+        """
+        Returns whether the side to move has any legal move, answered from the move cache if the position is in it.
+        """
+        index = self.move_cache().peek(pos)
+        if index is not None:
+            return len(index) > 0
         for m in self.legal_moves(pos):
-            if m == move: return True
+            return True
         return False
 
+    def move_cache(self) -> MoveCache:
+        """
+        Returns this variant's cache of recently queried positions' legal moves.
+        """
+        return self._move_cache
+
+    def move_index(self, pos: Position) -> MoveIndex:
+        """
+        Returns the legal moves of a position indexed by origin square, destination square and dropped piece.
+        Indexes are cached by position, asking again about the same position does not generate its moves again.
+        """
+        return self.move_cache().index(pos)
+
     def execute_move(self, pos: Position, move: Move) -> tuple[Position, list[BoardAction]]:
         """
         Performs a move. Returns the new position and a list of primitive board actions the move consists of.
         Note that the board actions do not necessarily contain all information about the move, usually that reflected in the Position's extra information.
-        The default implementation tries its best to interpret the move without variant-specific knowledge, this is okay for a lot of moves, but may be wrong if moves have extra effects, like castling, setting en-passant state, etc.
+        Variants describe their moves by overriding move_effects, this applies its result to a copy of the position.
         """
+        actions, extras = self.move_effects(pos, move)
         nextpos = PositionBuilder.from_position(pos)
         nextpos.ply(pos.ply + 1)
+        for a in actions:
+            nextpos.action(a)
+        for k, v in extras.items():
+            nextpos.extra(k, v, k not in self.UNKEYED_EXTRAS)
+        return nextpos.build(), actions
+
+    def move_effects(self, pos: BoardState, move: Move) -> tuple[list[BoardAction], dict[str, Any]]:
+        """
+        Describes a move without building the resulting position: returns the board actions to apply, in order, and the position extras the move changes.
+        The default implementation tries its best to interpret the move without variant-specific knowledge, this is okay for a lot of moves, but may be wrong if moves have extra effects, like castling, setting en-passant state, etc.
+        """
         color = Color.from_ply(pos.ply)
         actions = []
+        extras: dict[str, Any] = {}
 
         if move.fromsq is None and move.intopiece is not None:
             hand: Optional[HandType] = pos.get_extra("hand")
@@ -157,40 +264,31 @@ class Variant:
                     idx = bhand.index(move.intopiece)
                     bhand = bhand[:idx] + bhand[idx + 1:]
                 hand = whand, bhand
-                nextpos.extra("hand", hand)
-
-        if move.fromsq is not None:
-            nextpos.piece(move.fromsq, None)
+                extras["hand"] = hand
 
         if move.tosq is not None:
             if pos.get_piece(move.tosq) is not None:
-                nextpos.extra("lastcapture", pos.ply)
+                extras["lastcapture"] = pos.ply
             if move.fromsq is None:
-                nextpos.piece(move.tosq, move.intopiece)
                 actions.append(BoardAction(move.tosq, move.intopiece))
             else:
-                nextpos.piece(move.tosq, move.intopiece or pos.get_piece(move.fromsq))
                 actions.append(BoardAction(move.tosq, move.fromsq))
                 if move.intopiece is not None:
                     actions.append(BoardAction(move.tosq, move.intopiece))
 
-        return nextpos.build(), actions
+        return actions, extras
 
     def piece_legal_moves(self, pos: Position, fromsq: Square) -> Iterator[Move]:
         """
         Convenience function, returns legal moves involving a given piece (square).
         """
-        for move in self.legal_moves(pos):
-            if move.fromsq == fromsq:
-                yield move
+        return iter(self.move_index(pos).from_square(fromsq))
 
     def legal_drops(self, pos: Position, piecetype: Optional[Piece] = None) -> Iterator[Move]:
         """
         Convenience function, returns legal drop moves (potentially limited to a certain piece type).
         """
-        for move in self.legal_moves(pos):
-            if move.fromsq == None and (piecetype is None or piecetype == move.intopiece):
-                yield move
+        return iter(self.move_index(pos).drops(piecetype))
 
 
 class TicTacToe(Variant):
@@ -246,6 +344,10 @@ class Chess(Variant):
     CASTLE_SHORT = 1
     CASTLE_LONG = 2
 
+    def __init__(self) -> None:
+        super().__init__()
+        self._movement: dict[str, tuple[bool, bool, tuple[Direction, ...]]] = {}
+
     def uci_name(self) -> str:
         return "chess"
 
@@ -258,12 +360,23 @@ class Chess(Variant):
             b.piece(Square(file=x, rank=6), Piece("P", Color.BLACK))
         b.extra("castle", (3, 3))
         b.extra("ep", None)
+        return b.bitboards().build()
+
+    def pos_to_fen(self, pos: Position, state: Optional[GameState] = None) -> str:
+        return f"{fen_board(pos)} {fen_color(pos)} {fen_castle(pos)} {fen_ep(pos)} {fen_halfmove(state)} {fen_move(pos)}"
+
+    def pos_from_fen(self, fen: str) -> Position:
+        fields = fen.split()
+        board, color, castle, ep = fields[:4]
+        move = fields[5] if len(fields) > 5 else "1"
+        b = parse_fen_board(board).ply(parse_fen_ply(color, move))
+        b.extra("castle", (("K" in castle) * Chess.CASTLE_SHORT | ("Q" in castle) * Chess.CASTLE_LONG,
+                           ("k" in castle) * Chess.CASTLE_SHORT | ("q" in castle) * Chess.CASTLE_LONG))
+        b.extra("ep", Square.from_algebraic(ep) if ep != "-" else None)
+        if len(b.board) == 8 and len(b.board[0]) == 8:
+            b.bitboards()
         return b.build()
 
-    def pos_to_fen(self, pos: Position) -> str:
-        # TODO: Implement 50mr counter
-        return f"{fen_board(pos)} {fen_color(pos)} {fen_castle(pos)} {fen_ep(pos)} 0 {fen_move(pos)}"
-
     def can_move(self, piece: Piece, like: str) -> bool:
         assert like.upper() == like
         if like in "PNKQ":
@@ -274,148 +387,230 @@ class Chess(Variant):
             return piece.ty in "QR"
         raise ValueError(f"Don't know whether {piece.ty} moves like {like}")
 
-    def target_squares(self, pos: Position, square: Square, attack: bool = False) -> Iterator[Square]:
+    def movement(self, ty: str) -> tuple[bool, bool, tuple[Direction, ...]]:
+        """
+        Returns how a piece type moves: (like a knight, like a king, slider directions), derived from can_move and cached per type.
+        """
+        mv = self._movement.get(ty)
+        if mv is None:
+            piece = Piece(ty, Color.WHITE)
+            rays: tuple[Direction, ...] = ()
+            if self.can_move(piece, "B"):
+                rays += BISHOP_DIRECTIONS
+            if self.can_move(piece, "R"):
+                rays += ROOK_DIRECTIONS
+            mv = self._movement[ty] = (self.can_move(piece, "N"), self.can_move(piece, "K"), rays)
+        return mv
+
+    def target_squares(self, pos: BoardState, square: Square, attack: bool = False) -> Iterator[Square]:
         piece = pos.get_piece(square)
         if piece is None: return
         my = piece.color
-        relrank = pos.bounds()[1] - 1 - square.rank if my == Color.BLACK else square.rank
-        forwardy = 1 if my == Color.WHITE else -1
-        W = len(pos.board[0])
-        H = len(pos.board)
-        ox, oy = square.to_tuple()
+        geo = Geometry.of(*pos.bounds())
+        board = pos.board
 
         if piece.ty == "P":
+            relrank = geo.height - 1 - square.rank if my == Color.BLACK else square.rank
+            forwardy = 1 if my == Color.WHITE else -1
             upsq = square.offset(0, forwardy)
             assert pos.inbounds(upsq)
-            if pos.get_piece(upsq) is None and not attack:
+            if board[upsq.rank][upsq.file] is None and not attack:
                 yield upsq
-                _, height = pos.bounds()
                 up2sq = square.offset(0, 2 * forwardy)
-                if relrank == 1 and pos.get_piece(up2sq) is None:
+                if relrank == 1 and board[up2sq.rank][up2sq.file] is None:
                     yield up2sq
-            if ox > 0:
-                sq = upsq.offset(-1, 0)
-                p = pos.get_piece(sq)
-                if p is not None and p.color == ~my or attack:
+            for sq in geo.pawn_captures[my][square]:
+                p = board[sq.rank][sq.file]
+                if p is not None and p.color != my or attack:
                     yield sq
                 elif pos.get_extra("ep") == sq:
                     yield sq
-            if ox < W - 1:
-                sq = upsq.offset(1, 0)
-                p = pos.get_piece(sq)
-                if p is not None and p.color == ~my or attack:
+            return  # early return, do not handle pawn-like variant pieces
+        knight, king, rays = self.movement(piece.ty)
+        if knight:
+            for sq in geo.knight[square]:
+                p = board[sq.rank][sq.file]
+                if p is None or p.color != my:
                     yield sq
-                elif pos.get_extra("ep") == sq:
+        if king:
+            for sq in geo.king[square]:
+                p = board[sq.rank][sq.file]
+                if p is None or p.color != my:
                     yield sq
-            return  # early return, do not handle pawn-like variant pieces
-        if self.can_move(piece, "N"):
-            for m in range(8):
-                x, y = 1, 2
-                if m & 1: x, y = y, x
-                if m & 2: x = -x
-                if m & 4: y = -y
-                sq = square.offset(x, y)
-                if 0 <= ox + x < W and 0 <= oy + y < H:
-                    p = pos.get_piece(sq)
-                    if p is None or p.color == ~my:
-                        yield sq
-        if self.can_move(piece, "K"):
-            for x in {-1, 0, 1}:
-                for y in {-1, 0, 1}:
-                    sq = square.offset(x, y)
-                    if not pos.inbounds(sq): continue
-                    p = pos.get_piece(sq)
-                    if p is None or p.color == ~my:
-                        yield sq
             # NOTE: Castling is complex, but cannot capture pieces, handle separately when generating legal moves
-        rays = []
-        if self.can_move(piece, "B"):
-            for y in {-1, 1}:
-                for x in {-1, 1}:
-                    rays.append((x, y))
-        if self.can_move(piece, "R"):
-            for y in {-1, 1}: rays.append((0, y))
-            for x in {-1, 1}: rays.append((x, 0))
-        for x, y in rays:
-            cur = square
-            while True:
-                cur = cur.offset(x, y)
-                if not pos.inbounds(cur): break
-                p = pos.get_piece(cur)
+        for d in rays:
+            for sq in geo.rays[d][square]:
+                p = board[sq.rank][sq.file]
                 if p is None:
-                    yield cur
+                    yield sq
                 else:
-                    if p.color == ~my:
-                        yield cur
+                    if p.color != my:
+                        yield sq
                     break
 
-    def game_value(self, startpos: Position, moves: Iterable[Move]) -> Optional[GameEndValue]:
-        # TODO: Check 50mr, draw
-        # TODO: Check 3fr, draw
-        positions = [startpos]
-        for m in moves:
-            p, _ = self.execute_move(positions[-1], m)
-            positions.append(p)
-        pos = positions[-1]
-        for m in self.legal_moves(pos):
-            break
+    def init_game(self, state: GameState) -> None:
+        state.data["halfmove"] = 0  # Plies since the last capture or pawn move
+        state.data["material"] = (state.pos.material(Color.WHITE), state.pos.material(Color.BLACK))
+
+    @staticmethod
+    def _is_capture(prev: Position, move: Move, actions: list[BoardAction]) -> bool:
+        # En passant removes a piece with an action of its own
+        return prev.get_piece(move.tosq) is not None or any(a.fromsq is None and a.piece is None for a in actions)
+
+    def update_game(self, state: GameState, prev: Position, move: Move, actions: list[BoardAction]) -> None:
+        if move.fromsq is None or move.tosq is None:
+            return
+        piece = prev.get_piece(move.fromsq)
+        capture = self._is_capture(prev, move, actions)
+        if capture or (piece is not None and piece.ty == "P"):
+            state.data["halfmove"] = 0
         else:
-            # no legal moves
+            state.data["halfmove"] += 1
+        # Material only changes on captures and promotions
+        if capture or move.intopiece is not None:
+            state.data["material"] = (state.pos.material(Color.WHITE), state.pos.material(Color.BLACK))
+
+    def is_irreversible(self, prev: Position, move: Move, actions: list[BoardAction]) -> bool:
+        if move.fromsq is None or move.tosq is None:
+            return False
+        piece = prev.get_piece(move.fromsq)
+        if piece is not None and piece.ty == "P":
+            return True
+        return self._is_capture(prev, move, actions)
+
+    def is_rule_draw(self, state: GameState) -> bool:
+        """
+        Returns whether the game is drawn by the fifty-move rule or threefold repetition, applied automatically.
+        """
+        return state.data["halfmove"] >= 100 or state.repetitions() >= 3
+
+    def game_result(self, state: GameState) -> Optional[GameEndValue]:
+        pos = state.pos
+        if not self.has_legal_moves(pos):
             if self.is_in_check(pos, Color.from_ply(pos.ply)):  # Checkmate
                 return GameEndValue.win_for(~Color.from_ply(pos.ply))
             else:  # Stalemate
                 return GameEndValue.DRAW
 
+        if self.is_rule_draw(state):
+            return GameEndValue.DRAW
+
         # Insufficient material check
-        wmaterial = sorted([p.ty for _, p in pos.pieces_iter(Color.WHITE)])
-        bmaterial = sorted([p.ty for _, p in pos.pieces_iter(Color.BLACK)])
+        wmaterial, bmaterial = state.data["material"]
+        wcount = sum(wmaterial.values())
+        bcount = sum(bmaterial.values())
 
-        if len(wmaterial) == 1 or len(bmaterial) == 1:
-            omaterial = wmaterial if len(wmaterial) > 1 else bmaterial
-            if len(omaterial) == 1:
+        if wcount == 1 or bcount == 1:
+            omaterial = wmaterial if wcount > 1 else bmaterial
+            if sum(omaterial.values()) == 1:
                 return GameEndValue.DRAW
-            if len(omaterial) == 2 and set(omaterial) == {"K", "B"}:
+            if omaterial == {"K": 1, "B": 1}:
                 return GameEndValue.DRAW
-            if len(omaterial) == 2 and set(omaterial) == {"K", "N"}:
+            if omaterial == {"K": 1, "N": 1}:
                 return GameEndValue.DRAW
 
         return None
 
-    def is_in_check(self, pos: Position, color: Color) -> bool:
-        for sq, _ in pos.pieces_iter(~color):
-            for tsq in self.target_squares(pos, sq):
-                p = pos.get_piece(tsq)
-                if p is not None and p.color == color and p.ty == "K":
+    def is_square_attacked(self, pos: BoardState, sq: Square, by: Color, include_defended: bool = False) -> bool:
+        """
+        Returns whether a piece of color `by` attacks the square, that is, could capture a piece of the other color there.
+        A square occupied by a piece of color `by` is not attacked, unless include_defended is set,
+        in which case it is attacked if any piece of color `by` defends it.
+        Looks outward from the square for attackers of the matching kind instead of enumerating the attacker's moves.
+        """
+        board = pos.board
+        occupant = board[sq.rank][sq.file]
+        if occupant is not None and occupant.color == by and not include_defended:
+            return False
+        if isinstance(pos, BitboardPosition):
+            return bitboard.is_attacked(pos, bitboard.square_index(sq), by)
+        geo = Geometry.of(*pos.bounds())
+        # A pawn of `by` attacks sq from where a pawn of the other color on sq would capture
+        for s in geo.pawn_captures[~by][sq]:
+            p = board[s.rank][s.file]
+            if p is not None and p.color == by and p.ty == "P":
+                return True
+        for s in geo.knight[sq]:
+            p = board[s.rank][s.file]
+            if p is not None and p.color == by and p.ty != "P" and self.movement(p.ty)[0]:
+                return True
+        for s in geo.king[sq]:
+            p = board[s.rank][s.file]
+            if p is not None and p.color == by and p.ty != "P" and self.movement(p.ty)[1]:
+                return True
+        for d, rays in geo.rays.items():
+            for s in rays[sq]:
+                p = board[s.rank][s.file]
+                if p is None:
+                    continue
+                if p.color == by and p.ty != "P" and (-d[0], -d[1]) in self.movement(p.ty)[2]:
                     return True
+                break
+        return False
+
+    def is_in_check(self, pos: BoardState, color: Color) -> bool:
+        if isinstance(pos, BitboardPosition):
+            return bitboard.in_check(pos, color)
+        for sq in pos.piece_squares(Piece("K", color)):
+            if self.is_square_attacked(pos, sq, ~color):
+                return True
         return False
 
     def legal_moves(self, pos: Position) -> Iterator[Move]:
+        return self._legal_moves(pos, None)
+
+    def piece_legal_moves(self, pos: Position, fromsq: Square) -> Iterator[Move]:
+        """
+        Generates the legal moves of the piece on a given square directly, without generating the other pieces' moves,
+        unless the position's moves are cached already.
+        """
+        index = self.move_cache().peek(pos)
+        if index is not None:
+            return iter(index.from_square(fromsq))
+        if not pos.inbounds(fromsq):
+            return iter(())
+        return self._legal_moves(pos, fromsq)
+
+    def is_legal(self, pos: Position, move: Move) -> bool:
+        if move.fromsq is None or move.tosq is None:
+            return False  # no drops
+        piece = pos.get_piece(move.fromsq) if pos.inbounds(move.fromsq) else None
+        if piece is None or piece.color != Color.from_ply(pos.ply):
+            return False
+        index = self.move_cache().peek(pos)
+        if index is not None:
+            return move in index
+        return any(m == move for m in self._legal_moves(pos, move.fromsq))
+
+    def _legal_moves(self, pos: Position, fromsq: Optional[Square]) -> Iterator[Move]:
+        """
+        Generates the legal moves, only those of the piece on fromsq if it is given.
+        Variants restricting Chess moves further should override this, so legal_moves, piece_legal_moves and is_legal agree.
+        """
         # NOTE: Only supports 8x8 boards, smaller and larger variants should reimplement
+        if isinstance(pos, BitboardPosition):
+            yield from self._bitboard_legal_moves(pos, fromsq)
+            return
         my = Color.from_ply(pos.ply)
         rights = pos.get_extra("castle") or (0, 0)
         myrights = rights[0] if my == Color.WHITE else rights[1]
         homerank = 0 if my == Color.WHITE else 7
+        if fromsq is not None and fromsq != Square(rank=homerank, file=4):
+            myrights = 0
 
-        pieces = []
-        opppieces = []
-        attackedsq: set[Square] = set()
-        for sq, p in pos.pieces_iter():
-            if p.color == my:
-                pieces.append((sq, p))
-            else:
-                opppieces.append((sq, p))
-
-        incheck = self.is_in_check(pos, my)
-
-        for sq, p in opppieces:
-            for tsq in self.target_squares(pos, sq, attack=True):
-                attackedsq.add(tsq)
-
+        probe = SearchBoard(self, pos)
+        if fromsq is None:
+            pieces = pos.piece_list(my)
+        else:
+            p = pos.get_piece(fromsq)
+            pieces = [(fromsq, p)] if p is not None and p.color == my else []
         for sq, p in pieces:
             for tsq in self.target_squares(pos, sq):
                 # Does move lead to our king being threatened?
-                probepos, _ = self.execute_move(pos, Move.move(sq, tsq))
-                if self.is_in_check(probepos, my):
+                probe.push(Move.move(sq, tsq))
+                illegal = self.is_in_check(probe, my)
+                probe.pop()
+                if illegal:
                     continue  # if so, prune the move
 
                 # handle promotion case
@@ -425,49 +620,150 @@ class Chess(Variant):
                 else:
                     yield Move.move(sq, tsq)
 
-        if myrights & Chess.CASTLE_SHORT:
-            move = Move.move(Square(rank=homerank, file=4), Square(rank=homerank, file=6))
-            rookfrom = Square(rank=move.tosq.rank, file=7)
-            rookto = move.tosq.offset(-1, 0)
-            rook = pos.get_piece(rookfrom)
-            assert rook is not None
-            for i in {4, 5, 6, 7}:
-                sq = Square(rank=homerank, file=i)
-                if sq in attackedsq:
-                    break
-                if sq not in {move.fromsq, rookfrom}:
-                    if pos.get_piece(sq) is not None:
-                        break
-            else:
-                yield move
-        if myrights & Chess.CASTLE_LONG:
-            move = Move.move(Square(rank=homerank, file=4), Square(rank=homerank, file=2))
-            rookfrom = Square(rank=move.tosq.rank, file=0)
-            rookto = move.tosq.offset(-1, 0)
-            rook = pos.get_piece(rookfrom)
-            assert rook is not None
-            for i in {0, 1, 2, 3, 4}:
-                sq = Square(rank=homerank, file=i)
-                if sq in attackedsq:
-                    break
-                if sq not in {move.fromsq, rookfrom}:
-                    if pos.get_piece(sq) is not None:
-                        break
+        for side, rookfile, tofile in ((Chess.CASTLE_SHORT, 7, 6), (Chess.CASTLE_LONG, 0, 2)):
+            if not myrights & side:
+                continue
+            assert pos.get_piece(Square(rank=homerank, file=rookfile)) is not None
+            # The squares between king and rook must be empty, the king may not pass through or land on an attacked square
+            if any(pos.get_piece(Square(rank=homerank, file=i)) is not None for i in range(min(4, rookfile) + 1, max(4, rookfile))):
+                continue
+            if any(self.is_square_attacked(pos, Square(rank=homerank, file=i), ~my) for i in range(min(4, tofile), max(4, tofile) + 1)):
+                continue
+            yield Move.move(Square(rank=homerank, file=4), Square(rank=homerank, file=tofile))
+
+    def _bitboard_legal_moves(self, pos: BitboardPosition, origin: Optional[Square] = None) -> Iterator[Move]:
+        """
+        Same move set as the generic _legal_moves, computed from the occupancy masks, only for the piece on origin if it is given.
+        Checkers and pinned pieces are found once, so only king moves and en passant captures need probing.
+        """
+        my = Color.from_ply(pos.ply)
+        us = bitboard.color_index(my)
+        own = pos.occupancy[us]
+        opp = pos.occupancy[1 - us]
+        occ = own | opp
+        pawns, knights, diagonal, orthogonal, kings = bitboard.side_masks(pos, ~my)
+        ownkings = pos.bitboards.get("K" if my == Color.WHITE else "k", 0)
+        forward = 8 if my == Color.WHITE else -8
+        ep: Optional[Square] = pos.get_extra("ep")
+        epidx = bitboard.square_index(ep) if ep is not None else -1
+
+        def is_safe(fromidx: int, toidx: int, capidx: int) -> bool:
+            keep = ~(1 << capidx)
+            after = (occ & ~(1 << fromidx) & keep) | 1 << toidx
+            ks = ownkings
+            if ks >> fromidx & 1:
+                ks ^= 1 << fromidx | 1 << toidx
+            for kidx in bitboard.iter_bits(ks):
+                if bitboard.attacked(kidx, after, pawns & keep, knights & keep, diagonal & keep, orthogonal & keep,
+                                     kings & keep, 1 - us):
+                    return False
+            return True
+
+        # Squares that resolve a check, and the lines pinned pieces are confined to.
+        # Positions without a king never need checking, with several kings every move is probed instead.
+        evasions = bitboard.ALL
+        pins: dict[int, int] = {}
+        probe_all = bool(ownkings & (ownkings - 1))
+        if ownkings and not probe_all:
+            kidx = ownkings.bit_length() - 1
+            checkers, pins = bitboard.checkers_and_pins(kidx, occ, own, pawns, knights, diagonal, orthogonal, kings, us)
+            if checkers & (checkers - 1):  # double check, only the king can move
+                evasions = 0
+            elif checkers:
+                evasions = checkers | bitboard.BETWEEN[kidx][checkers.bit_length() - 1]
+
+        movers = own if origin is None else own & 1 << bitboard.square_index(origin)
+        for fromidx in bitboard.iter_bits(movers):
+            p = pos.board[fromidx >> 3][fromidx & 7]
+            assert p is not None
+            fromsq = bitboard.index_square(fromidx)
+            allowed = evasions & pins.get(fromidx, bitboard.ALL)
+            if p.ty == "P":
+                upidx = fromidx + forward
+                assert 0 <= upidx < 64
+                targets = 0
+                if not occ >> upidx & 1:
+                    targets |= 1 << upidx
+                    relrank = fromsq.rank if my == Color.WHITE else 7 - fromsq.rank
+                    if relrank == 1 and not occ >> (upidx + forward) & 1:
+                        targets |= 1 << (upidx + forward)
+                captures = bitboard.PAWN_ATTACKS[us][fromidx]
+                targets |= captures & opp
+                if epidx >= 0 and captures >> epidx & 1:
+                    targets |= 1 << epidx
+                for toidx in bitboard.iter_bits(targets):
+                    if toidx == epidx or probe_all:
+                        if not is_safe(fromidx, toidx, toidx - forward if toidx == epidx else toidx):
+                            continue
+                    elif not allowed >> toidx & 1:
+                        continue
+                    tosq = bitboard.index_square(toidx)
+                    if tosq.rank in {0, 7}:
+                        for ty in "QNRB":
+                            yield Move.move_promote(fromsq, tosq, Piece(ty, my))
+                    else:
+                        yield Move.move(fromsq, tosq)
+                continue
+            targets = 0
+            if p.ty == "N":
+                targets |= bitboard.KNIGHT_ATTACKS[fromidx]
+            if p.ty == "K":
+                targets |= bitboard.KING_ATTACKS[fromidx]
+            if p.ty in {"B", "Q"}:
+                targets |= bitboard.bishop_attacks(fromidx, occ)
+            if p.ty in {"R", "Q"}:
+                targets |= bitboard.rook_attacks(fromidx, occ)
+            targets &= ~own
+            if p.ty == "K" or probe_all:
+                for toidx in bitboard.iter_bits(targets):
+                    if is_safe(fromidx, toidx, toidx):
+                        yield Move.move(fromsq, bitboard.index_square(toidx))
             else:
-                yield move
+                for toidx in bitboard.iter_bits(targets & allowed):
+                    yield Move.move(fromsq, bitboard.index_square(toidx))
 
-    def execute_move(self, pos: Position, move: Move) -> tuple[Position, list[BoardAction]]:
+        rights = pos.get_extra("castle") or (0, 0)
+        myrights = rights[0] if my == Color.WHITE else rights[1]
+        homerank = 0 if my == Color.WHITE else 7
+        if origin is not None and origin != Square(rank=homerank, file=4):
+            myrights = 0
+        for side, rookfile, tofile in ((Chess.CASTLE_SHORT, 7, 6), (Chess.CASTLE_LONG, 0, 2)):
+            if not myrights & side:
+                continue
+            assert pos.board[homerank][rookfile] is not None
+            between = sum(1 << (homerank * 8 + i) for i in range(min(4, rookfile) + 1, max(4, rookfile)))
+            if occ & between:
+                continue
+            if any(bitboard.attacked(homerank * 8 + i, occ, pawns, knights, diagonal, orthogonal, kings, 1 - us)
+                   for i in range(min(4, tofile), max(4, tofile) + 1)):
+                continue
+            yield Move.move(Square(rank=homerank, file=4), Square(rank=homerank, file=tofile))
+
+    def move_effects(self, pos: BoardState, move: Move) -> tuple[list[BoardAction], dict[str, Any]]:
         # TODO: 50mr counters
-        maybepos, actions = super().execute_move(pos, move)
-        nextpos = PositionBuilder.from_position(maybepos).extra("ep", None)  # Lose en passant rights
+        actions, extras = super().move_effects(pos, move)
+        extras["ep"] = None  # Lose en passant rights
         if move.fromsq is not None:
             fromsq = move.fromsq
         else:  # piece drop or null move, let the generic impl handle it
-            return nextpos.build(), actions
+            return actions, extras
         piece = pos.get_piece(fromsq)
         assert piece is not None
-        if piece.ty in "NBQ":  # "simple" piece type
-            return nextpos.build(), actions
+        rights: Optional[tuple[int, int]] = pos.get_extra("castle")
+        if rights is not None:
+            # Moving off the king or rook home squares, or capturing on them, loses the matching castling rights
+            castlew, castleb = rights
+            for sq in (fromsq, move.tosq):
+                if sq.rank in {0, 7} and sq.file in {0, 4, 7}:  # TODO: Chess960
+                    lost = {0: Chess.CASTLE_LONG, 4: Chess.CASTLE_LONG | Chess.CASTLE_SHORT, 7: Chess.CASTLE_SHORT}[sq.file]
+                    if sq.rank == 0:
+                        castlew &= ~lost
+                    else:
+                        castleb &= ~lost
+            if (castlew, castleb) != rights:
+                extras["castle"] = (castlew, castleb)
+        if piece.ty in "NBQR":  # "simple" piece type
+            return actions, extras
         my = piece.color
         forwardy = 1 if my == Color.WHITE else -1
         homerank = 0 if my == Color.WHITE else 7
@@ -475,25 +771,20 @@ class Chess(Variant):
             ep = pos.get_extra("ep")
             if ep is not None and move.tosq == ep:
                 capturesq = move.tosq.offset(0, -forwardy)
-                nextpos.piece(capturesq, None)
                 actions.append(BoardAction(capturesq, None))
             elif move.tosq == fromsq.offset(0, 2 * forwardy):
                 sq = move.tosq.offset(-1, 0)
                 if pos.inbounds(sq):
                     p = pos.get_piece(sq)
                     if p is not None and p.color == ~my and p.ty == "P":
-                        nextpos.extra("ep", move.tosq.offset(0, -forwardy))
+                        extras["ep"] = move.tosq.offset(0, -forwardy)
                 sq = move.tosq.offset(1, 0)
                 if pos.inbounds(sq):
                     p = pos.get_piece(move.tosq.offset(1, 0))
                     if p is not None and p.color == ~my and p.ty == "P":
-                        nextpos.extra("ep", move.tosq.offset(0, -forwardy))
+                        extras["ep"] = move.tosq.offset(0, -forwardy)
 
-            return nextpos.build(), actions
-        castlew: int
-        castleb: int
-        castlew, castleb = pos.get_extra("castle") or (3, 3)
-        mycastle = castlew if my == Color.WHITE else castleb
+            return actions, extras
         if piece.ty == "K":
             if fromsq.rank == homerank and move.tosq.rank == homerank and abs(move.fromsq.file - move.tosq.file) > 1:
                 # TODO: Add validity checking?
@@ -507,23 +798,8 @@ class Chess(Variant):
                     rookto = move.tosq.offset(-1, 0)
                 rook = pos.get_piece(rookfrom)
                 assert rook is not None
-                nextpos.piece(rookfrom, None)
-                nextpos.piece(rookto, rook)
                 actions.append(BoardAction(rookto, rookfrom))
-            if my == Color.WHITE:
-                castlew = 0
-            else:
-                castleb = 0
-            nextpos.extra("castle", (castlew, castleb))
-            return nextpos.build(), actions
-        if piece.ty == "R":
-            if fromsq.rank == homerank and fromsq.file in {0, 7}:  # TODO: Chess960
-                if my == Color.WHITE:
-                    castlew &= ~(Chess.CASTLE_LONG if fromsq.file == 0 else Chess.CASTLE_SHORT)
-                else:
-                    castleb &= ~(Chess.CASTLE_LONG if fromsq.file == 0 else Chess.CASTLE_SHORT)
-                nextpos.extra("castle", (castlew, castleb))
-            return nextpos.build(), actions
+            return actions, extras
         raise ValueError(f"Bad piece {piece!r}")
 
 
@@ -539,7 +815,7 @@ class NoCastleChess(Chess):
             b.piece(Square(file=x, rank=1), Piece("P", Color.WHITE))
             b.piece(Square(file=x, rank=6), Piece("P", Color.BLACK))
         b.extra("ep", None)
-        return b.build()
+        return b.bitboards().build()
 
 
 class PawnsOnly(Chess):
@@ -552,21 +828,15 @@ class PawnsOnly(Chess):
             b.piece(Square(file=file, rank=1), Piece("P", Color.WHITE))
             b.piece(Square(file=file, rank=6), Piece("P", Color.BLACK))
         b.extra("ep", None)
-        return b.build()
+        return b.bitboards().build()
 
-    def game_value(self, startpos: Position, moves: Iterable[Move]) -> Optional[GameEndValue]:
-        positions = [startpos]
-        for m in moves:
-            pos, _ = self.execute_move(positions[-1], m)
-            positions.append(pos)
-        pos = positions[-1]
-        for sq, p in pos.pieces_iter():
+    def game_result(self, state: GameState) -> Optional[GameEndValue]:
+        pos = state.pos
+        for sq, p in pos.piece_list():
             if sq.rank in {0,7}:
                 return GameEndValue.win_for(p.color)
 
-        for m in self.legal_moves(pos):
-            break
-        else:
+        if not self.has_legal_moves(pos):
             return GameEndValue.DRAW # Stalemate
 
         return None
@@ -586,14 +856,10 @@ class RacingKings(Chess):
                 b.piece(Square(file=x, rank=rank), Piece(ty, Color.BLACK))
         b.extra("castle", (0, 0))
         b.extra("ep", None)
-        return b.build()
+        return b.bitboards().build()
 
-    def game_value(self, startpos: Position, moves: Iterable[Move]) -> Optional[GameEndValue]:
-        positions = [startpos]
-        for m in moves:
-            p, _ = self.execute_move(positions[-1], m)
-            positions.append(p)
-        pos = positions[-1]
+    def game_result(self, state: GameState) -> Optional[GameEndValue]:
+        pos = state.pos
         my = Color.from_ply(pos.ply)
         my_ksq, opp_ksq = get_kingsq(pos, my)
 
@@ -607,14 +873,17 @@ class RacingKings(Chess):
             return GameEndValue.win_for(~my)
 
         if opp_ksq.rank == 7 and my_ksq.rank == 6:  # But sometimes we can't force a draw if no king moves to the last rank are available
-            for m in self.legal_moves(pos):
-                if m.fromsq == my_ksq and m.tosq.rank == 7:
+            for m in self.piece_legal_moves(pos, my_ksq):
+                if m.tosq.rank == 7:
                     return None
             return GameEndValue.win_for(~my)
 
+        if self.is_rule_draw(state):
+            return GameEndValue.DRAW
+
         return None
 
-    def legal_moves(self, pos: Position) -> Iterator[Move]:
+    def _legal_moves(self, pos: Position, fromsq: Optional[Square]) -> Iterator[Move]:
         my = Color.from_ply(pos.ply)
         my_ksq, opp_ksq = get_kingsq(pos, my)
         assert my_ksq is not None
@@ -622,8 +891,13 @@ class RacingKings(Chess):
         if my_ksq.rank == 7: return
         if opp_ksq.rank == 7 and my_ksq.rank < 6: return
 
-        for m in super().legal_moves(pos):
+        for m in super()._legal_moves(pos, fromsq):
             # Does move lead to checking other king?
+            if isinstance(pos, BitboardPosition) and m.fromsq is not None and m.intopiece is None:
+                if bitboard.in_check_after(pos, bitboard.square_index(m.fromsq), bitboard.square_index(m.tosq), ~my):
+                    continue
+                yield m
+                continue
             probepos, _ = self.execute_move(pos, m)
             if self.is_in_check(probepos, ~my):
                 continue  # if so, prune the move
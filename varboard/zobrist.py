@@ -0,0 +1,37 @@
+"""
+Zobrist keys for positions. Keys are derived from a hash of their description instead of a seeded random generator,
+so they are identical across processes and independent of the board size.
+"""
+from __future__ import annotations
+
+import functools
+import hashlib
+from typing import Any
+
+
+def _key(description: str) -> int:
+    return int.from_bytes(hashlib.blake2b(description.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# XORed in when black is to move
+SIDE_KEY = _key("side:b")
+
+_piece_keys: dict[tuple[str, int, int], int] = {}
+
+
+def piece_key(piece: str, rank: int, file: int) -> int:
+    """
+    Key for a piece, given by its FEN letter, standing on a square.
+    """
+    k = _piece_keys.get((piece, rank, file))
+    if k is None:
+        k = _piece_keys[piece, rank, file] = _key(f"piece:{piece}@{file},{rank}")
+    return k
+
+
+@functools.lru_cache(maxsize=4096)
+def extra_key(prop: str, data: Any) -> int:
+    """
+    Key for a position extra (castle rights, en passant square, hands, ...), the data must be immutable and hashable.
+    """
+    return _key(f"extra:{prop}={data!r}")